@@ -26,6 +26,12 @@ class Config:
         self.NEON_DB_PASSWORD = os.getenv('NEON_DB_PASSWORD', '')
         self.NEON_DB_PORT = int(os.getenv('NEON_DB_PORT', '5432'))
         self.DATABASE_URL = os.getenv('DATABASE_URL', '')
+        self.DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '20'))
+        
+        # Optional Redis cache in front of Neon reads (disabled when empty)
+        self.REDIS_URL = os.getenv('REDIS_URL', '')
+        self.EMAIL_STATS_CACHE_TTL = int(os.getenv('EMAIL_STATS_CACHE_TTL', '60'))
+        self.EMAIL_LIST_CACHE_TTL = int(os.getenv('EMAIL_LIST_CACHE_TTL', '60'))
         
         # In-built Key Manager Configuration (No External API)
         self.ENABLE_EMBEDDED_KM = os.getenv('ENABLE_EMBEDDED_KM', 'True').lower() == 'true'
@@ -64,9 +70,12 @@ class Config:
         self.SMTP_SERVER = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
         self.SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
         self.SMTP_USE_TLS = os.getenv('SMTP_USE_TLS', 'True').lower() == 'true'
+        self.SMTP_MAX_CONNECTIONS = int(os.getenv('SMTP_MAX_CONNECTIONS', '4'))
+        self.SMTP_MESSAGES_PER_CONNECTION = int(os.getenv('SMTP_MESSAGES_PER_CONNECTION', '100'))
         self.IMAP_SERVER = os.getenv('IMAP_SERVER', 'imap.gmail.com')
         self.IMAP_PORT = int(os.getenv('IMAP_PORT', '993'))
         self.IMAP_USE_SSL = os.getenv('IMAP_USE_SSL', 'True').lower() == 'true'
+        self.IMAP_SEARCH_DAYS = int(os.getenv('IMAP_SEARCH_DAYS', '30'))
         
         self.SYSTEM_EMAIL = os.getenv('SYSTEM_EMAIL', '')
         self.SYSTEM_EMAIL_PASSWORD = os.getenv('SYSTEM_EMAIL_PASSWORD', '')
@@ -43,7 +43,7 @@ key_id = '82d8e999-4bef-4989-8963-591e797df667'
 encrypted_content = 'q3+5dEeay2/Jfgsf2QN5hTG8vPQARfzoFxPsmg=='
 
 # Get the key
-user_keys = km.get_user_keys(recipient, include_expired=True)
+user_keys = km.get_user_keys(recipient, include_expired=True, decrypt_keys=True)
 actual_key = None
 for key in user_keys:
     if key.get('key_id') == key_id:
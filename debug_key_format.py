@@ -24,7 +24,7 @@ def debug_key_format():
     # Get keys using the method from test script (works)
     print("📋 METHOD 1: Test script method (get_user_keys with email)")
     print("-" * 50)
-    user_keys_by_email = key_manager.get_user_keys(recipient_email, include_expired=True)
+    user_keys_by_email = key_manager.get_user_keys(recipient_email, include_expired=True, decrypt_keys=True)
     key_data_raw = None
     
     print(f"Found {len(user_keys_by_email)} keys for email {recipient_email}")
@@ -57,7 +57,7 @@ def debug_key_format():
     print(f"User ID: {user_id}")
     
     if user_id:
-        user_keys = key_manager.get_user_keys(user_id, include_expired=True)
+        user_keys = key_manager.get_user_keys(user_id, include_expired=True, decrypt_keys=True)
         print(f"Found {len(user_keys)} keys for user")
         
         for i, key in enumerate(user_keys):
@@ -8,7 +8,10 @@ backlog = 2048
 
 # Worker processes
 workers = int(os.getenv('WEB_CONCURRENCY', '2'))
-worker_class = "sync"
+# Threaded workers: requests mostly wait on SMTP, Postgres and IPFS, so
+# one process can serve several of them concurrently
+worker_class = "gthread"
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
 worker_connections = 1000
 timeout = 30
 keepalive = 2
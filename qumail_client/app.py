@@ -7,20 +7,30 @@ Flask Web Application
 import os
 import sys
 from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
 from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
 import logging
 from datetime import datetime, timedelta
-import json
-import base64
+import hashlib
+import orjson
+try:
+    # SIMD-accelerated drop-in replacement for the stdlib base64 module
+    import pybase64 as base64
+except ImportError:
+    import base64
 import tempfile
+import threading
+import time
+from collections import OrderedDict
 
 # Add project root to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config.settings import load_config
-from qumail_client.embedded_km.neon_key_manager import NeonKeyManager
+from qumail_client.embedded_km.neon_key_manager import NeonKeyManager, InboxPage
 from qumail_client.crypto.quantum_encryption import QuantumEncryption
 from qumail_client.email.email_client import EmailClient
 from qumail_client.blockchain.verification import BlockchainVerifier
@@ -29,18 +39,60 @@ from qumail_client.ipfs.storage import IPFSStorage
 # Load environment variables (but don't override existing environment variables)
 load_dotenv(override=False)
 
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider that serializes with orjson"""
+    
+    # Datetimes go through Flask's default hook so they keep the HTTP date format
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    
+    def dumps(self, obj, **kwargs):
+        indent = kwargs.pop('indent', None)
+        sort_keys = kwargs.pop('sort_keys', False)
+        if kwargs or indent not in (None, 2):
+            # orjson only knows two-space indents; anything else goes through the stdlib
+            return super().dumps(obj, indent=indent, sort_keys=sort_keys, **kwargs)
+        option = self.option
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self.option),
+            mimetype=self.mimetype
+        )
+
 # Initialize Flask app
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # Configuration for production deployment
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'qumail_dev_secret_key_2024')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///qumail.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Only send Set-Cookie when the session actually changes, not on every response
+app.config['SESSION_REFRESH_EACH_REQUEST'] = False
 
 # Handle Render.com specific database URL format
 if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgres://'):
     app.config['SQLALCHEMY_DATABASE_URI'] = app.config['SQLALCHEMY_DATABASE_URI'].replace('postgres://', 'postgresql://')
 
+# Size the connection pool explicitly and validate connections before use so
+# connections dropped by the server's idle timeout aren't handed to requests
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql://'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', '20')),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '10')),
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,
+    }
+
 # Initialize SQLAlchemy
 db = SQLAlchemy(app)
 
@@ -49,7 +101,7 @@ db = SQLAlchemy(app)
 def tojsonpretty_filter(value):
     """Convert value to pretty JSON string"""
     try:
-        return json.dumps(value, indent=2, ensure_ascii=False)
+        return orjson.dumps(value, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
     except (TypeError, ValueError):
         return str(value)
 # Configure logging for production
@@ -66,6 +118,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Prefix added to the subject of every outgoing secure email
+SUBJECT_PREFIX = os.getenv('QUMAIL_SUBJECT_PREFIX', '[QuMail Secure] ')
+
 # Global components
 config = None
 key_manager = None
@@ -73,64 +128,115 @@ quantum_crypto = None
 email_client = None
 blockchain_verifier = None
 ipfs_storage = None
+_components_initialized = False
+_components_lock = threading.Lock()
+
+# Small in-process LRU cache for values that are expensive to recompute per
+# request, cache_key -> (value, expires_at), bounded to PERFORMANCE_CACHE_SIZE
+PERFORMANCE_CACHE_SIZE = 10000
+performance_cache = OrderedDict()
+_performance_cache_lock = threading.Lock()
+
+def get_cached(cache_key):
+    """Return a cached value, or None if it is missing or expired"""
+    with _performance_cache_lock:
+        entry = performance_cache.get(cache_key)
+        if entry is None:
+            return None
+        if time.monotonic() >= entry[1]:
+            del performance_cache[cache_key]
+            return None
+        performance_cache.move_to_end(cache_key)
+        return entry[0]
+
+def set_cache(cache_key, value, ttl_seconds):
+    """Store a value in the performance cache for ttl_seconds"""
+    with _performance_cache_lock:
+        performance_cache[cache_key] = (value, time.monotonic() + ttl_seconds)
+        performance_cache.move_to_end(cache_key)
+        while len(performance_cache) > PERFORMANCE_CACHE_SIZE:
+            performance_cache.popitem(last=False)
+
+def invalidate_cache(cache_key):
+    """Drop a value from the performance cache"""
+    with _performance_cache_lock:
+        performance_cache.pop(cache_key, None)
 
 def initialize_components():
     """Initialize all QuMail components with fallback handling"""
-    global config, key_manager, quantum_crypto, email_client, blockchain_verifier, ipfs_storage
+    global config, key_manager, quantum_crypto, email_client, blockchain_verifier, ipfs_storage, _components_initialized
     
-    try:
-        # Load configuration
-        config = load_config()
-        logger.info("Configuration loaded successfully")
-        
-        # Initialize components with individual error handling
-        try:
-            if config and hasattr(config, 'DATABASE_URL') and config.DATABASE_URL:
-                key_manager = NeonKeyManager(config)
-                logger.info("Neon Key Manager initialized")
-            else:
-                logger.warning("Key Manager skipped - no database configuration")
-                key_manager = None
-        except Exception as e:
-            logger.warning(f"Key Manager initialization failed: {e}")
-            key_manager = None
+    # Double-checked locking so concurrent first callers don't build components twice
+    if _components_initialized:
+        return True
+    
+    with _components_lock:
+        if _components_initialized:
+            return True
         
         try:
-            quantum_crypto = QuantumEncryption(config)
-            logger.info("Quantum encryption initialized")
-        except Exception as e:
-            logger.warning(f"Quantum encryption initialization failed: {e}")
-            quantum_crypto = None
+            # Load configuration
+            config = load_config()
+            logger.info("Configuration loaded successfully")
         
-        try:
-            email_client = EmailClient(config)
-            logger.info("Email client initialized")
-        except Exception as e:
-            logger.warning(f"Email client initialization failed: {e}")
-            email_client = None
+            # Initialize components with individual error handling
+            try:
+                if config and hasattr(config, 'DATABASE_URL') and config.DATABASE_URL:
+                    key_manager = NeonKeyManager(config)
+                    logger.info("Neon Key Manager initialized")
+                else:
+                    logger.warning("Key Manager skipped - no database configuration")
+                    key_manager = None
+            except Exception as e:
+                logger.warning(f"Key Manager initialization failed: {e}")
+                key_manager = None
         
-        # Initialize Blockchain Verifier (optional)
-        if hasattr(config, 'ENABLE_BLOCKCHAIN_VERIFICATION') and config.ENABLE_BLOCKCHAIN_VERIFICATION:
             try:
-                blockchain_verifier = BlockchainVerifier(config)
-                logger.info("Blockchain verifier initialized")
+                quantum_crypto = QuantumEncryption(config)
+                logger.info("Quantum encryption initialized")
             except Exception as e:
-                logger.warning(f"Blockchain verifier initialization failed: {e}")
-                blockchain_verifier = None
+                logger.warning(f"Quantum encryption initialization failed: {e}")
+                quantum_crypto = None
         
-        # Initialize IPFS Storage (optional)
-        if hasattr(config, 'ENABLE_IPFS_STORAGE') and config.ENABLE_IPFS_STORAGE:
             try:
-                ipfs_storage = IPFSStorage(config)
-                logger.info("IPFS storage initialized")
+                email_client = EmailClient(config)
+                logger.info("Email client initialized")
             except Exception as e:
-                logger.warning(f"IPFS storage initialization failed: {e}")
-                ipfs_storage = None
+                logger.warning(f"Email client initialization failed: {e}")
+                email_client = None
+        
+            # Initialize Blockchain Verifier (optional)
+            if hasattr(config, 'ENABLE_BLOCKCHAIN_VERIFICATION') and config.ENABLE_BLOCKCHAIN_VERIFICATION:
+                try:
+                    blockchain_verifier = BlockchainVerifier(config)
+                    logger.info("Blockchain verifier initialized")
+                except Exception as e:
+                    logger.warning(f"Blockchain verifier initialization failed: {e}")
+                    blockchain_verifier = None
+        
+            # Initialize IPFS Storage (optional)
+            if hasattr(config, 'ENABLE_IPFS_STORAGE') and config.ENABLE_IPFS_STORAGE:
+                try:
+                    ipfs_storage = IPFSStorage(config)
+                    logger.info("IPFS storage initialized")
+                except Exception as e:
+                    logger.warning(f"IPFS storage initialization failed: {e}")
+                    ipfs_storage = None
             
-    except Exception as e:
-        logger.error(f"Critical configuration error: {e}")
-        # Still allow the app to start with minimal functionality
-        config = None
+        except Exception as e:
+            logger.error(f"Critical configuration error: {e}")
+            # Still allow the app to start with minimal functionality
+            config = None
+        
+        # Compile templates up front so the first request doesn't pay for it
+        try:
+            for template_name in app.jinja_env.list_templates(extensions=['html']):
+                app.jinja_env.get_template(template_name)
+            logger.info("Templates precompiled")
+        except Exception as e:
+            logger.warning(f"Template precompilation failed: {e}")
+        
+        _components_initialized = True
     
     return True
 
@@ -146,10 +252,12 @@ def health_check():
             'environment': os.getenv('FLASK_ENV', 'development')
         }
         
-        # Check database connection
+        # Check database connection (a successful probe is reused for 10 seconds)
         try:
-            with app.app_context():
-                db.engine.execute("SELECT 1")
+            if get_cached('health_db') is None:
+                with db.engine.connect() as conn:
+                    conn.execute(text("SELECT 1"))
+                set_cache('health_db', 'connected', 10)
             status['database'] = 'connected'
         except Exception as e:
             status['database'] = f'error: {str(e)}'
@@ -279,7 +387,7 @@ def login():
         
         if auth_result['success']:
             session['user_id'] = email
-            session['username'] = email.split('@')[0]
+            session['username'] = email.partition('@')[0]
             flash('Login successful!', 'success')
             return redirect(url_for('dashboard'))
         else:
@@ -433,7 +541,7 @@ def compose():
             # Send email
             email_data = {
                 'recipient': recipient,
-                'subject': f"[QuMail Secure] {subject}",
+                'subject': SUBJECT_PREFIX + subject,
                 'body': f"Encrypted message (Key ID: {quantum_key['key_id']})\nIPFS: {ipfs_hash}\nBlockchain: {blockchain_hash}",
                 'encrypted_content': encrypted_message
             }
@@ -451,7 +559,7 @@ def compose():
                             subject=subject,
                             ipfs_hash=ipfs_hash,
                             encryption_key_id=quantum_key['key_id'],
-                            encrypted_content=base64.b64encode(encrypted_message if isinstance(encrypted_message, bytes) else encrypted_message.encode('utf-8')).decode('utf-8')
+                            encrypted_content=base64.b64encode(encrypted_message).decode('ascii')
                         )
                         
                         # Skip recipient recording for performance - they'll see it when they check inbox"
@@ -477,45 +585,21 @@ def inbox():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    all_emails = []
-    sent_count = 0
-    received_count = 0
+    page = InboxPage()
     
     try:
         if key_manager:
-            # Get emails with optimized query (limit to recent 50 emails)
-            all_user_emails = key_manager.get_user_inbox(session['user_id'])
-            
-            # Process emails efficiently
-            for email in all_user_emails[:50]:  # Limit to 50 most recent
-                all_emails.append({
-                    'id': email.get('id', ''),
-                    'type': email.get('type', ''),
-                    'sender': email.get('sender', ''),
-                    'recipient': email.get('recipient', ''),
-                    'subject': email.get('subject', ''),
-                    'timestamp': email.get('timestamp', ''),
-                    'encrypted': True,
-                    'key_id': email.get('encryption_key_id', ''),
-                    'has_documents': bool(email.get('ipfs_hash'))
-                })
-                
-                # Count by type
-                if email.get('type') == 'sent':
-                    sent_count += 1
-                elif email.get('type') == 'received':
-                    received_count += 1
-            
-            # Already sorted by database query (newest first)
+            # Recent 50 emails plus per-type totals, shaped and counted in SQL
+            page = key_manager.get_inbox_page(session['user_id'], limit=50)
             
     except Exception as e:
         logger.error(f"Failed to get emails: {e}")
         flash(f'Error loading emails: {str(e)}', 'error')
     
     return render_template('inbox.html', 
-                         emails=all_emails, 
-                         sent_count=sent_count, 
-                         received_count=received_count)
+                         emails=page.emails, 
+                         sent_count=page.sent_count, 
+                         received_count=page.received_count)
 
 @app.route('/view_email/<int:email_id>')
 def view_email(email_id):
@@ -529,30 +613,8 @@ def view_email(email_id):
     
     try:
         if key_manager:
-            # Get email from both sent and received
-            sent_emails = key_manager.get_sent_emails(session['user_id'])
-            received_emails = key_manager.get_received_emails(session['user_id'])
-            
-            logger.info(f"Looking for email {email_id} among {len(sent_emails)} sent and {len(received_emails)} received emails")
-            
-            # Find the email and mark its type
-            for email in sent_emails:
-                if email.get('id') == email_id:
-                    email_data = email
-                    email_data['type'] = 'sent'
-                    email_data['sender'] = session['user_id']  # Sender is current user
-                    logger.info(f"Found SENT email {email_id}: {email.get('subject')}")
-                    break
-            
-            # If not found in sent, check received
-            if not email_data:
-                for email in received_emails:
-                    if email.get('id') == email_id:
-                        email_data = email
-                        email_data['type'] = 'received'
-                        # sender field should already be set from database
-                        logger.info(f"Found RECEIVED email {email_id}: {email.get('subject')}")
-                        break
+            # Get email (sent or received) with a single indexed lookup
+            email_data = key_manager.get_email_by_id(email_id, session['user_id'])
             
             if not email_data:
                 flash('Email not found', 'error')
@@ -572,24 +634,11 @@ def view_email(email_id):
                     
                     if key_id:
                         # Get decryption key - include expired keys to handle old emails
-                        user_keys = key_manager.get_user_keys(session['user_id'], include_expired=True)
-                        decryption_key = None
-                        
-                        logger.info(f"Found {len(user_keys)} total keys for user {session['user_id']}")
-                        logger.info(f"Looking for key_id: '{key_id}'")
-                        
-                        # Log all available keys for debugging
-                        for i, key in enumerate(user_keys):
-                            logger.info(f"Key {i+1}: ID='{key.get('key_id')}', Purpose={key.get('purpose')}, Expired={key.get('expired')}")
-                        
-                        for key in user_keys:
-                            if key.get('key_id') == key_id:
-                                decryption_key = key.get('key_data')
-                                logger.info(f"✓ Found matching key: {key_id}")
-                                logger.info(f"Key data type: {type(decryption_key)}, Length: {len(decryption_key) if decryption_key else 0}")
-                                break
+                        key = key_manager.get_key_by_id(key_id, session['user_id'], include_expired=True)
+                        decryption_key = key.get('key_data') if key else None
                         
                         if decryption_key:
+                            logger.info(f"✓ Found matching key: {key_id}")
                             # Ensure decryption key is bytes
                             if isinstance(decryption_key, str):
                                 try:
@@ -645,7 +694,7 @@ def view_email(email_id):
                                 logger.error("All decryption methods failed!")
                                 decrypted_content = "Content is encrypted - all decryption methods failed"
                         else:
-                            logger.error(f"✗ Decryption key {key_id} not found among {len(user_keys)} keys")
+                            logger.error(f"✗ Decryption key {key_id} not found for user {session['user_id']}")
                             decrypted_content = "Content is encrypted - decryption key not found or invalid"
                     else:
                         logger.error("✗ No key_id found for this email")
@@ -886,18 +935,7 @@ def send_email():
                     purpose='email_encryption'
                 )
                 encryption_key_id = key_result['key_id']
-                
-                # **CRITICAL**: Share the key with the recipient so they can decrypt
-                try:
-                    key_manager.share_key_with_recipient(
-                        key_id=encryption_key_id,
-                        sender_id=sender,
-                        recipient_id=recipient
-                    )
-                    logger.info(f"Shared decryption key {encryption_key_id} with recipient {recipient}")
-                except Exception as e:
-                    logger.error(f"Failed to share key with recipient: {e}")
-                    # Continue anyway - sender can still decrypt
+                # The key is shared with the recipient once the email is delivered
                     
             except Exception as e:
                 return jsonify({'success': False, 'error': f'Failed to generate encryption key: {str(e)}'}), 500
@@ -905,7 +943,7 @@ def send_email():
             encryption_key_id = encryption_key
             # Get existing key data
             try:
-                key_result = key_manager.get_key(encryption_key_id)
+                key_result = key_manager.get_key(encryption_key_id, sender)
                 if not key_result:
                     return jsonify({'success': False, 'error': 'Specified encryption key not found'}), 400
             except Exception as e:
@@ -952,7 +990,7 @@ def send_email():
         email_send_result = email_client.send_secure_email({
             'sender': sender,  # Pass the actual sender
             'recipient': recipient,
-            'subject': f"[QuMail Secure] {subject}",
+            'subject': SUBJECT_PREFIX + subject,
             'encrypted_content': encrypted_content,
             'attachments': attachment_paths  # File paths for email sending
         })
@@ -960,32 +998,20 @@ def send_email():
         if email_send_result.get('success'):
             logger.info(f"Secure email sent from {sender} to {recipient}")
             
-            # Record email statistics for BOTH sender and recipient
-            try:
-                # Record for sender (existing logic)
-                key_manager.record_email_sent(
-                    user_id=sender,
-                    recipient=recipient,
-                    subject=subject,
-                    ipfs_hash=ipfs_hash,
-                    encryption_key_id=encryption_key_id,
-                    encrypted_content=base64.b64encode(encrypted_content if isinstance(encrypted_content, bytes) else encrypted_content.encode('utf-8')).decode('utf-8')
-                )
-                
-                # NEW: Record for recipient as a received email
-                key_manager.record_email_received(
-                    user_id=recipient,
-                    sender=sender,
-                    subject=subject,
-                    ipfs_hash=ipfs_hash,
-                    encryption_key_id=encryption_key_id,
-                    encrypted_content=base64.b64encode(encrypted_content if isinstance(encrypted_content, bytes) else encrypted_content.encode('utf-8')).decode('utf-8')
-                )
-                
-                logger.info(f"Email recorded for both sender ({sender}) and recipient ({recipient})")
-                
-            except Exception as e:
-                logger.warning(f"Failed to record email statistics: {e}")
+            # Record the email for BOTH sender and recipient and share the
+            # generated key with the recipient so they can decrypt, all in one
+            # transaction (a failure here doesn't undo the delivered email)
+            recorded = key_manager.record_and_share(
+                sender=sender,
+                recipient=recipient,
+                subject=subject,
+                ipfs_hash=ipfs_hash,
+                encryption_key_id=encryption_key_id,
+                encrypted_content=base64.b64encode(encrypted_content).decode('ascii'),
+                share_key=(encryption_key == 'auto')
+            )
+            if not recorded:
+                logger.warning(f"Failed to record email statistics for {sender} -> {recipient}")
             
             # Clean up temporary attachment files
             for temp_path in attachment_paths:
@@ -1021,6 +1047,99 @@ def send_email():
         logger.error(f"Error sending email: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _decrypt_email_content(email_data, user_id):
+    """Fetch and decrypt an email's content, returns (content, decrypted successfully)"""
+    # Try to get encrypted content from IPFS first, fallback to database
+    decrypted_content = "Unable to decrypt content"
+    encrypted_content = None
+    
+    # First try IPFS
+    if email_data.get('ipfs_hash') and ipfs_storage:
+        try:
+            ipfs_result = ipfs_storage.retrieve_email(email_data['ipfs_hash'])
+            if ipfs_result.get('success'):
+                stored_email_data = ipfs_result.get('data', {})
+                encrypted_content = stored_email_data.get('encrypted_content', '')
+                logger.info("Successfully retrieved content from IPFS")
+            else:
+                logger.warning(f"IPFS retrieval failed: {ipfs_result.get('error', 'Unknown error')}")
+        except Exception as ipfs_error:
+            logger.warning(f"IPFS retrieval error: {ipfs_error}")
+    
+    # Fallback to database if IPFS failed
+    if not encrypted_content and email_data.get('encrypted_content'):
+        encrypted_content = email_data.get('encrypted_content')
+        logger.info("Using encrypted content from database as fallback")
+    
+    # Decrypt content if we have it
+    decryption_successful = False
+    if encrypted_content and quantum_crypto and email_data.get('encryption_key_id'):
+        try:
+            # Get the quantum key used for encryption - include expired keys
+            key = key_manager.get_key_by_id(email_data.get('encryption_key_id'), user_id, include_expired=True)
+            encryption_key_data = key.get('key_data') if key else None
+            
+            if encryption_key_data:
+                # Ensure key is bytes
+                if isinstance(encryption_key_data, str):
+                    try:
+                        encryption_key_data = base64.b64decode(encryption_key_data)
+                    except:
+                        encryption_key_data = encryption_key_data.encode('utf-8')
+                
+                # Try multiple decryption methods
+                decryption_methods = [
+                    # Method 1: Base64 decode + decrypt
+                    lambda: quantum_crypto.decrypt_message(
+                        base64.b64decode(encrypted_content) if isinstance(encrypted_content, str) else encrypted_content,
+                        encryption_key_data
+                    ),
+                    # Method 2: Direct decrypt
+                    lambda: quantum_crypto.decrypt_message(
+                        encrypted_content if isinstance(encrypted_content, bytes) else encrypted_content.encode('utf-8'),
+                        encryption_key_data
+                    ),
+                    # Method 3: Hex decode + decrypt
+                    lambda: quantum_crypto.decrypt_message(
+                        bytes.fromhex(encrypted_content) if isinstance(encrypted_content, str) else encrypted_content,
+                        encryption_key_data
+                    )
+                ]
+                
+                decryption_successful = False
+                for i, method in enumerate(decryption_methods):
+                    try:
+                        decrypted_content = method()
+                        if isinstance(decrypted_content, bytes):
+                            decrypted_content = decrypted_content.decode('utf-8')
+                        logger.info(f"Successfully decrypted using method {i+1}")
+                        decryption_successful = True
+                        break
+                    except Exception as e:
+                        pass  # Skip logging for performance
+                        continue
+                
+                if not decryption_successful:
+                    decrypted_content = "Content is encrypted - all decryption methods failed"
+                    
+            else:
+                logger.error(f"Encryption key {email_data.get('encryption_key_id')} not found")
+                decrypted_content = "Content is encrypted - decryption key not found"
+                
+        except Exception as decrypt_error:
+            logger.error(f"Failed to decrypt email content: {decrypt_error}")
+            decrypted_content = f"Content is encrypted - decryption error: {str(decrypt_error)}"
+    elif not encrypted_content:
+        decrypted_content = "No content available"
+    elif not quantum_crypto:
+        decrypted_content = "Quantum crypto system not available"
+    elif not email_data.get('encryption_key_id'):
+        decrypted_content = "No encryption key ID available"
+    else:
+        decrypted_content = "Unknown decryption issue"
+    
+    return decrypted_content, decryption_successful
+
 @app.route('/api/email/<email_id>')
 def get_email(email_id):
     """Get email details with decryption"""
@@ -1032,119 +1151,33 @@ def get_email(email_id):
         if not key_manager:
             return jsonify({'success': False, 'error': 'Key manager not available'}), 500
             
-        sent_emails = key_manager.get_sent_emails(session['user_id'])
-        email_data = None
-        
-        # Find the specific email
-        for email in sent_emails:
-            if str(email.get('id', '')) == str(email_id):
-                email_data = email
-                break
+        email_data = key_manager.get_email_by_id(email_id, session['user_id'])
         
         if not email_data:
             return jsonify({'success': False, 'error': 'Email not found'}), 404
         
-        # Try to get encrypted content from IPFS first, fallback to database
-        decrypted_content = "Unable to decrypt content"
-        encrypted_content = None
-        
-        # First try IPFS
-        if email_data.get('ipfs_hash') and ipfs_storage:
-            try:
-                ipfs_result = ipfs_storage.retrieve_email(email_data['ipfs_hash'])
-                if ipfs_result.get('success'):
-                    stored_email_data = ipfs_result.get('data', {})
-                    encrypted_content = stored_email_data.get('encrypted_content', '')
-                    logger.info("Successfully retrieved content from IPFS")
-                else:
-                    logger.warning(f"IPFS retrieval failed: {ipfs_result.get('error', 'Unknown error')}")
-            except Exception as ipfs_error:
-                logger.warning(f"IPFS retrieval error: {ipfs_error}")
-        
-        # Fallback to database if IPFS failed
-        if not encrypted_content and email_data.get('encrypted_content'):
-            encrypted_content = email_data.get('encrypted_content')
-            logger.info("Using encrypted content from database as fallback")
-        
-        # Decrypt content if we have it
-        if encrypted_content and quantum_crypto and email_data.get('encryption_key_id'):
-            try:
-                # Get the quantum key used for encryption - include expired keys
-                user_keys = key_manager.get_user_keys(session['user_id'], include_expired=True)
-                encryption_key_data = None
-                
-                logger.info(f"Looking for encryption key: {email_data.get('encryption_key_id')}")
-                logger.info(f"User has {len(user_keys)} keys available")
-                
-                for key in user_keys:
-                    if key.get('key_id') == email_data.get('encryption_key_id'):
-                        encryption_key_data = key.get('key_data')
-                        logger.info("Found matching encryption key!")
-                        break
-                
-                if encryption_key_data:
-                    # Ensure key is bytes
-                    if isinstance(encryption_key_data, str):
-                        try:
-                            encryption_key_data = base64.b64decode(encryption_key_data)
-                        except:
-                            encryption_key_data = encryption_key_data.encode('utf-8')
-                    
-                    # Try multiple decryption methods
-                    decryption_methods = [
-                        # Method 1: Base64 decode + decrypt
-                        lambda: quantum_crypto.decrypt_message(
-                            base64.b64decode(encrypted_content) if isinstance(encrypted_content, str) else encrypted_content,
-                            encryption_key_data
-                        ),
-                        # Method 2: Direct decrypt
-                        lambda: quantum_crypto.decrypt_message(
-                            encrypted_content if isinstance(encrypted_content, bytes) else encrypted_content.encode('utf-8'),
-                            encryption_key_data
-                        ),
-                        # Method 3: Hex decode + decrypt
-                        lambda: quantum_crypto.decrypt_message(
-                            bytes.fromhex(encrypted_content) if isinstance(encrypted_content, str) else encrypted_content,
-                            encryption_key_data
-                        )
-                    ]
-                    
-                    decryption_successful = False
-                    for i, method in enumerate(decryption_methods):
-                        try:
-                            decrypted_content = method()
-                            if isinstance(decrypted_content, bytes):
-                                decrypted_content = decrypted_content.decode('utf-8')
-                            logger.info(f"Successfully decrypted using method {i+1}")
-                            decryption_successful = True
-                            break
-                        except Exception as e:
-                            pass  # Skip logging for performance
-                            continue
-                    
-                    if not decryption_successful:
-                        decrypted_content = "Content is encrypted - all decryption methods failed"
-                        
-                else:
-                    logger.error(f"Encryption key {email_data.get('encryption_key_id')} not found")
-                    decrypted_content = "Content is encrypted - decryption key not found"
-                    
-            except Exception as decrypt_error:
-                logger.error(f"Failed to decrypt email content: {decrypt_error}")
-                decrypted_content = f"Content is encrypted - decryption error: {str(decrypt_error)}"
-        elif not encrypted_content:
-            decrypted_content = "No content available"
-        elif not quantum_crypto:
-            decrypted_content = "Quantum crypto system not available"
-        elif not email_data.get('encryption_key_id'):
-            decrypted_content = "No encryption key ID available"
+        # Stored emails never change, so the id/key pair identifies the response;
+        # let clients revalidate without re-fetching and re-decrypting
+        etag = hashlib.md5(
+            f"{session['user_id']}:{email_data.get('id')}:{email_data.get('encryption_key_id')}".encode(),
+            usedforsecurity=False
+        ).hexdigest()
+        if request.if_none_match.contains(etag):
+            return '', 304
+        
+        # Decrypted content is cached per email, tagged with the ETag it was
+        # produced for; the lookup above still checks the email exists and is the user's
+        cache_key = f"email:{session['user_id']}:{email_id}"
+        cached = get_cached(cache_key)
+        if cached is not None and cached[0] == etag:
+            decrypted_content, decryption_successful = cached[1], True
         else:
-            decrypted_content = "Unknown decryption issue"
+            decrypted_content, decryption_successful = _decrypt_email_content(email_data, session['user_id'])
         
         response_data = {
             'id': email_data.get('id', ''),
-            'sender': session['user_id'],
-            'recipient': email_data.get('recipient', ''),
+            'sender': email_data.get('sender') or session['user_id'],
+            'recipient': email_data.get('recipient') or session['user_id'],
             'subject': email_data.get('subject', ''),
             'content': decrypted_content,
             'timestamp': email_data.get('sent_at', ''),
@@ -1153,7 +1186,14 @@ def get_email(email_id):
             'ipfs_hash': email_data.get('ipfs_hash', '')
         }
         
-        return jsonify({'success': True, 'email': response_data})
+        response = jsonify({'success': True, 'email': response_data})
+        # Only successfully decrypted content is stable enough to cache and revalidate.
+        # Clients must revalidate every time so a deleted email is never served from cache
+        if decryption_successful:
+            set_cache(cache_key, (etag, decrypted_content), 120)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+        return response
         
     except Exception as e:
         logger.error(f"Error getting email: {e}")
@@ -1171,6 +1211,7 @@ def delete_email(email_id):
         
         # Delete email from database
         success = key_manager.delete_email(email_id, session['user_id'])
+        invalidate_cache(f"email:{session['user_id']}:{email_id}")
         
         if success:
             logger.info(f"Email {email_id} deleted by user {session['user_id']}")
@@ -1198,14 +1239,10 @@ def delete_multiple_emails():
         if not email_ids:
             return jsonify({'success': False, 'error': 'No email IDs provided'}), 400
         
-        # Delete emails from database
-        deleted_count = 0
+        # Delete emails from database in a single statement
+        deleted_count = key_manager.delete_emails_bulk(email_ids, session['user_id'])
         for email_id in email_ids:
-            try:
-                if key_manager.delete_email(email_id, session['user_id']):
-                    deleted_count += 1
-            except Exception as e:
-                logger.warning(f"Failed to delete email {email_id}: {e}")
+            invalidate_cache(f"email:{session['user_id']}:{email_id}")
         
         logger.info(f"Deleted {deleted_count}/{len(email_ids)} emails for user {session['user_id']}")
         return jsonify({
@@ -1228,17 +1265,14 @@ def get_key_details(key_id):
         
         # Get key details from key manager
         user_email = session['user_id']
-        keys = key_manager.get_user_keys(user_email)
-        
-        key_details = None
-        for key in keys:
-            if key['key_id'] == key_id:
-                key_details = key
-                break
+        key = key_manager.get_key_by_id(key_id, user_email, include_expired=False)
         
-        if not key_details:
+        if not key:
             return jsonify({'success': False, 'error': 'Key not found'}), 404
         
+        # Never send raw key material to the browser
+        key_details = {k: v for k, v in key.items() if k != 'key_data'}
+        
         return jsonify({'success': True, 'key': key_details})
         
     except Exception as e:
@@ -1308,19 +1342,13 @@ def debug_manual_decrypt():
             return jsonify({'success': False, 'error': 'Missing encrypted_content or key_id'}), 400
         
         # Get the key
-        user_keys = key_manager.get_user_keys(session['user_id'], include_expired=True)
-        decryption_key = None
-        
-        for key in user_keys:
-            if key.get('key_id') == key_id:
-                decryption_key = key.get('key_data')
-                break
+        key = key_manager.get_key_by_id(key_id, session['user_id'], include_expired=True)
+        decryption_key = key.get('key_data') if key else None
         
         if not decryption_key:
             return jsonify({
                 'success': False, 
-                'error': f'Key {key_id} not found',
-                'details': f'Available keys: {[k.get("key_id") for k in user_keys]}'
+                'error': f'Key {key_id} not found'
             }), 404
         
         # Ensure key is bytes
@@ -1413,19 +1441,9 @@ def fix_old_emails():
 
 # Debug functionality removed for production performance
 
-@app.route('/favicon.ico')
-def favicon():
-    """Serve favicon"""
-    return '', 204
-
-@app.route('/apple-touch-icon.png')
-def apple_touch_icon():
-    """Serve apple touch icon"""
-    return '', 204
-
-@app.route('/apple-touch-icon-precomposed.png')
-def apple_touch_icon_precomposed():
-    """Serve apple touch icon precomposed"""
+@app.route('/<any("favicon.ico", "apple-touch-icon.png", "apple-touch-icon-precomposed.png"):icon>')
+def browser_icon(icon):
+    """Answer browser icon probes with an empty response"""
     return '', 204
 
 @app.route('/settings')
@@ -1450,15 +1468,30 @@ def create_directories():
     for directory in directories:
         os.makedirs(directory, exist_ok=True)
 
+def prepare_app():
+    """Create directories, initialize components and database tables (safe to call more than once)"""
+    # Create necessary directories
+    create_directories()
+    
+    # Initialize components (non-blocking)
+    initialize_components()
+    logger.info("Component initialization completed")
+    
+    # Create database tables if they don't exist
+    try:
+        with app.app_context():
+            db.create_all()
+            logger.info("Database tables created/verified")
+            # With preload_app this runs in the gunicorn master; drop the pooled
+            # connections so forked workers open their own instead of sharing sockets
+            db.engine.dispose()
+    except Exception as e:
+        logger.warning(f"Database table creation failed: {e}")
+
 def main():
-    """Main application entry point"""
+    """Main application entry point (development server)"""
     try:
-        # Create necessary directories
-        create_directories()
-        
-        # Initialize components (non-blocking)
-        initialize_components()
-        logger.info("Component initialization completed")
+        prepare_app()
         
         # Get Flask configuration from environment
         # For cloud deployment (like Render), use 0.0.0.0 and PORT env var
@@ -1478,14 +1511,6 @@ def main():
         logger.info(f"Environment: {os.getenv('FLASK_ENV', 'development')}")
         logger.info(f"Debug mode: {debug}")
         
-        # Create database tables if they don't exist
-        try:
-            with app.app_context():
-                db.create_all()
-                logger.info("Database tables created/verified")
-        except Exception as e:
-            logger.warning(f"Database table creation failed: {e}")
-        
         # Run Flask application
         app.run(
             host=host,
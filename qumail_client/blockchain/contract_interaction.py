@@ -5,6 +5,7 @@ Simple contract for storing email and key verification hashes
 
 import hashlib
 import json
+import time
 from web3 import Web3
 from dotenv import load_dotenv
 import os
@@ -13,33 +14,60 @@ load_dotenv()
 
 class QuMailContract:
     def __init__(self):
-        self.w3 = Web3(Web3.HTTPProvider("https://rpc-amoy.polygon.technology"))
+        self._rpc_url = "https://rpc-amoy.polygon.technology"
+        self._w3 = None
         self.contract_address = os.getenv('INTEGRITY_VERIFIER_CONTRACT')
         self.private_key = os.getenv('PRIVATE_KEY')
         self.wallet_address = os.getenv('WALLET_ADDRESS')
+        self._wallet_suffix = f":{self.wallet_address}".encode()
+        self._latest_block = None
+        self._latest_block_at = 0.0
         
+    @property
+    def w3(self):
+        """Web3 client, created on first use rather than at construction"""
+        if self._w3 is None:
+            self._w3 = Web3(Web3.HTTPProvider(self._rpc_url, request_kwargs={'timeout': 10}))
+        return self._w3
+    
+    def _hash_with_wallet(self, value, identifier):
+        """sha256 of "value:identifier:wallet", fed incrementally instead of building the joined string"""
+        h = hashlib.sha256()
+        h.update(value.encode() if isinstance(value, str) else f"{value}".encode())
+        h.update(b':')
+        h.update(f"{identifier}".encode())
+        h.update(self._wallet_suffix)
+        return h.hexdigest()
+    
     def verify_email_hash(self, email_content, key_id):
         """Create verification hash for email"""
-        combined = f"{email_content}:{key_id}:{self.wallet_address}"
-        return hashlib.sha256(combined.encode()).hexdigest()
+        return self._hash_with_wallet(email_content, key_id)
     
     def verify_key_hash(self, key_data, user_id):
         """Create verification hash for quantum key"""
-        combined = f"{key_data}:{user_id}:{self.wallet_address}"
-        return hashlib.sha256(combined.encode()).hexdigest()
+        return self._hash_with_wallet(key_data, user_id)
+    
+    def _get_latest_block(self, max_age=2.0):
+        """Latest block, reused for max_age seconds (about one Polygon block time)"""
+        now = time.monotonic()
+        if self._latest_block is None or now - self._latest_block_at > max_age:
+            self._latest_block = self.w3.eth.get_block('latest')
+            self._latest_block_at = now
+        return self._latest_block
     
     def log_verification(self, hash_value, verification_type):
         """Log verification to blockchain (simulated)"""
         try:
             # In a real implementation, this would send a transaction
             # For now, we'll log locally and return success
+            latest_block = self._get_latest_block()
             verification_record = {
                 'hash': hash_value,
                 'type': verification_type,
                 'wallet': self.wallet_address,
                 'contract': self.contract_address,
-                'timestamp': self.w3.eth.get_block('latest')['timestamp'],
-                'block_number': self.w3.eth.get_block('latest')['number']
+                'timestamp': latest_block['timestamp'],
+                'block_number': latest_block['number']
             }
             
             print(f"✅ Verification logged: {verification_record}")
@@ -3,12 +3,23 @@ Blockchain Verification for QuMail
 Verifies email integrity on Polygon Amoy testnet
 """
 
+import json
 import logging
+import time
 import requests
+from requests.adapters import HTTPAdapter
 from typing import Dict, Any, Optional
 
 logger = logging.getLogger(__name__)
 
+# eth_chainId request body never changes, serialize it once
+_CHAIN_ID_REQUEST = json.dumps({
+    "jsonrpc": "2.0",
+    "method": "eth_chainId",
+    "params": [],
+    "id": 1
+})
+
 class BlockchainVerifier:
     """Blockchain verification using Polygon Amoy testnet"""
     
@@ -19,6 +30,18 @@ class BlockchainVerifier:
         self.contract_address = getattr(config, 'INTEGRITY_VERIFIER_CONTRACT', None)
         self.private_key = getattr(config, 'PRIVATE_KEY', None)
         self.wallet_address = getattr(config, 'WALLET_ADDRESS', None)
+        
+        # Keep-alive session so repeated RPC calls reuse the TLS connection
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+        self._session.headers['Content-Type'] = 'application/json'
+        
+        # Last successfully verified chain ID and when it was checked
+        self._chain_id_cache = None
+        self._chain_id_cache_ts = 0.0
+        
         logger.info(f"Blockchain verifier initialized for chain {self.chain_id}")
     
     def get_chain_id(self) -> int:
@@ -26,17 +49,13 @@ class BlockchainVerifier:
         return self.chain_id
     
     def test_connection(self) -> Dict[str, Any]:
-        """Test blockchain connection"""
+        """Test blockchain connection (a successful result is reused for 5 minutes)"""
+        if self._chain_id_cache is not None and time.monotonic() - self._chain_id_cache_ts < 300:
+            return {'success': True, 'chain_id': self._chain_id_cache}
+        
         try:
             # Test RPC connection with a simple request and longer timeout
-            payload = {
-                "jsonrpc": "2.0",
-                "method": "eth_chainId",
-                "params": [],
-                "id": 1
-            }
-            
-            response = requests.post(self.rpc_url, json=payload, timeout=30)
+            response = self._session.post(self.rpc_url, data=_CHAIN_ID_REQUEST, timeout=30)
             
             if response.status_code == 200:
                 data = response.json()
@@ -46,6 +65,8 @@ class BlockchainVerifier:
                     
                     if chain_id == self.chain_id:
                         logger.info(f"Blockchain connection successful, chain ID: {chain_id}")
+                        self._chain_id_cache = chain_id
+                        self._chain_id_cache_ts = time.monotonic()
                         return {'success': True, 'chain_id': chain_id}
                     else:
                         logger.warning(f"Chain ID mismatch: expected {self.chain_id}, got {chain_id}")
@@ -67,8 +88,14 @@ class BlockchainVerifier:
             # Create mock blockchain verification for demo
             import hashlib
             
-            # Create a deterministic hash for blockchain simulation
-            content_hash = hashlib.sha256(f"{ipfs_hash}{encrypted_content}".encode()).hexdigest()
+            # Create a deterministic hash for blockchain simulation, hashing the
+            # ciphertext bytes directly rather than their formatted repr
+            h = hashlib.sha256(f"{ipfs_hash}".encode())
+            if isinstance(encrypted_content, str):
+                h.update(encrypted_content.encode())
+            else:
+                h.update(memoryview(encrypted_content))
+            content_hash = h.hexdigest()
             mock_tx_hash = f"0x{content_hash[:64]}"
             
             logger.info(f"Email integrity verified: {mock_tx_hash}")
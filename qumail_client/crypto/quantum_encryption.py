@@ -4,13 +4,75 @@ Implements quantum-inspired encryption using One-Time Pad (OTP)
 """
 
 import os
+import base64
 import secrets
 import logging
 import hashlib
+from functools import lru_cache
 from typing import Union
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 logger = logging.getLogger(__name__)
 
+def _xor_numpy(data, key, length: int) -> bytes:
+    """Vectorized XOR in numpy's C loop"""
+    return (np.frombuffer(data, dtype=np.uint8, count=length) ^
+            np.frombuffer(key, dtype=np.uint8, count=length)).tobytes()
+
+def _xor_int(data, key, length: int) -> bytes:
+    """XOR as one arbitrary-precision integer operation (no numpy needed)"""
+    return (int.from_bytes(memoryview(data)[:length], 'little') ^
+            int.from_bytes(memoryview(key)[:length], 'little')).to_bytes(length, 'little')
+
+# Fastest available XOR implementation, picked once at import
+_XOR_IMPL = _xor_numpy if np is not None else _xor_int
+
+def _xor_bytes(data: bytes, key: bytes) -> bytes:
+    """XOR data with key, truncated to the shorter of the two like zip()"""
+    length = min(len(data), len(key))
+    if length == 0:
+        return b''
+    return _XOR_IMPL(data, key, length)
+
+def _b64_or_utf8(value: str) -> bytes:
+    """Decode base64 text, or encode as UTF-8 if it isn't base64"""
+    # The lenient decode drops whitespace and other non-alphabet characters
+    # (e.g. line-wrapped MIME base64)
+    try:
+        return base64.b64decode(value)
+    except ValueError as e:
+        # binascii.Error for bad padding, plain ValueError for non-ASCII text
+        logger.warning(f"Base64 decode failed: {e}, trying UTF-8 encode")
+        return value.encode('utf-8')
+
+# Size of the tiled key block used when a short key has to be repeated
+_XOR_BLOCK_SIZE = 64 * 1024
+
+def _xor_repeating(data: bytes, key: bytes) -> bytes:
+    """XOR data with key, repeating the key as needed without building a full-length copy of it"""
+    if len(data) <= len(key):
+        return _xor_bytes(data, key)
+    
+    # Whole repetitions of the key, so every block starts at key offset 0
+    block = key * max(1, _XOR_BLOCK_SIZE // len(key))
+    block_size = len(block)
+    view = memoryview(data)
+    out = bytearray(len(data))
+    for start in range(0, len(data), block_size):
+        chunk = view[start:start + block_size]
+        out[start:start + len(chunk)] = _XOR_IMPL(chunk, block, len(chunk))
+    return bytes(out)
+
+@lru_cache(maxsize=1024)
+def _derive_otp_key(key_id: str, length: int) -> bytes:
+    """PBKDF2 key derivation for a key ID, cached so each (key_id, length) pays the 100k iterations once"""
+    salt = b"qumail_salt_2024"
+    return hashlib.pbkdf2_hmac('sha256', key_id.encode(), salt, 100000, length)
+
 class QuantumEncryption:
     """Quantum-inspired encryption using One-Time Pad"""
     
@@ -27,7 +89,7 @@ class QuantumEncryption:
         
         # Use secrets for cryptographically secure random generation
         key = secrets.token_bytes(length)
-        logger.info(f"Generated quantum key of {length} bytes")
+        logger.debug("Generated quantum key of %d bytes", length)
         return key
     
     def encrypt_otp(self, data: bytes, key_id: str) -> bytes:
@@ -37,8 +99,8 @@ class QuantumEncryption:
             derived_key = self._derive_key_from_id(key_id, len(data))
             
             # XOR encryption (One-Time Pad)
-            encrypted = bytes(d ^ k for d, k in zip(data, derived_key))
-            logger.info(f"Data encrypted with OTP ({len(encrypted)} bytes)")
+            encrypted = _xor_bytes(data, derived_key)
+            logger.debug("Data encrypted with OTP (%d bytes)", len(encrypted))
             return encrypted
             
         except Exception as e:
@@ -52,8 +114,8 @@ class QuantumEncryption:
             derived_key = self._derive_key_from_id(key_id, len(encrypted_data))
             
             # XOR decryption (One-Time Pad)
-            decrypted = bytes(e ^ k for e, k in zip(encrypted_data, derived_key))
-            logger.info(f"Data decrypted with OTP ({len(decrypted)} bytes)")
+            decrypted = _xor_bytes(encrypted_data, derived_key)
+            logger.debug("Data decrypted with OTP (%d bytes)", len(decrypted))
             return decrypted
             
         except Exception as e:
@@ -63,22 +125,19 @@ class QuantumEncryption:
     def _derive_key_from_id(self, key_id: str, length: int) -> bytes:
         """Derive encryption key from key ID"""
         # Use PBKDF2 for key derivation (simplified for demo)
-        salt = b"qumail_salt_2024"
-        key = hashlib.pbkdf2_hmac('sha256', key_id.encode(), salt, 100000, length)
-        return key
+        return _derive_otp_key(key_id, length)
     
     def encrypt_message(self, message: str, key: bytes) -> bytes:
-        """Encrypt message using quantum key"""
+        """Encrypt message using quantum key
+        
+        Always returns raw ciphertext bytes; callers base64-encode it for storage.
+        """
         try:
             message_bytes = message.encode('utf-8')
             
-            if len(key) < len(message_bytes):
-                # Extend key if needed (not ideal for true OTP, but practical)
-                extended_key = (key * ((len(message_bytes) // len(key)) + 1))[:len(message_bytes)]
-                key = extended_key
-            
-            encrypted = bytes(m ^ k for m, k in zip(message_bytes, key))
-            logger.info(f"Message encrypted successfully ({len(encrypted)} bytes)")
+            # Key is repeated if shorter than the message (not ideal for true OTP, but practical)
+            encrypted = _xor_repeating(message_bytes, key)
+            logger.debug("Message encrypted successfully (%d bytes)", len(encrypted))
             return encrypted
             
         except Exception as e:
@@ -88,36 +147,18 @@ class QuantumEncryption:
     def decrypt_message(self, encrypted_data, key) -> str:
         """Decrypt message using quantum key"""
         try:
-            import base64
-            
-            # Ensure encrypted_data is bytes
+            # Ensure encrypted_data is bytes (base64 is the most common case)
             if isinstance(encrypted_data, str):
-                try:
-                    # Try base64 decode first (most common case)
-                    encrypted_data = base64.b64decode(encrypted_data)
-                    logger.info("Converted encrypted data from base64 string to bytes")
-                except Exception as e:
-                    logger.warning(f"Base64 decode failed: {e}, trying UTF-8 encode")
-                    encrypted_data = encrypted_data.encode('utf-8')
+                encrypted_data = _b64_or_utf8(encrypted_data)
             
             # Ensure key is bytes
             if isinstance(key, str):
-                try:
-                    # Try base64 decode first (most common case)
-                    key = base64.b64decode(key)
-                    logger.info("Converted key from base64 string to bytes")
-                except Exception as e:
-                    logger.warning(f"Base64 decode of key failed: {e}, trying UTF-8 encode")
-                    key = key.encode('utf-8')
-            
-            if len(key) < len(encrypted_data):
-                # Extend key if needed
-                extended_key = (key * ((len(encrypted_data) // len(key)) + 1))[:len(encrypted_data)]
-                key = extended_key
+                key = _b64_or_utf8(key)
             
-            decrypted_bytes = bytes(e ^ k for e, k in zip(encrypted_data, key))
+            # Key is repeated if shorter than the data
+            decrypted_bytes = _xor_repeating(encrypted_data, key)
             message = decrypted_bytes.decode('utf-8')
-            logger.info("Message decrypted successfully")
+            logger.debug("Message decrypted successfully")
             return message
             
         except Exception as e:
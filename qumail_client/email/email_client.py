@@ -6,16 +6,44 @@ Handles secure email sending and receiving
 import logging
 import smtplib
 import imaplib
-import email
 import os
+import re
+import atexit
+import base64
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.parser import BytesHeaderParser
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
-from email import encoders
 from typing import List, Dict, Any
 
 logger = logging.getLogger(__name__)
 
+# Attachments are base64 encoded in chunks of whole 57-byte input lines,
+# so each chunk encodes to complete 76-character MIME lines
+_ATTACHMENT_CHUNK_SIZE = 57 * 1024
+
+# Only the headers shown in the inbox list; PEEK leaves \Seen untouched
+_IMAP_HEADER_FETCH = '(UID BODY.PEEK[HEADER.FIELDS (FROM SUBJECT DATE)])'
+_IMAP_UID_RE = re.compile(rb'UID (\d+)')
+
+# Fields a secure email cannot be sent without
+_REQUIRED_FIELDS = ('recipient', 'subject', 'encrypted_content')
+
+_BODY_TEMPLATE = """This is a secure email sent via QuMail - Quantum Secure Email Client.
+
+From: {sender}
+To: {recipient}
+
+The content has been encrypted using quantum encryption and stored on IPFS.
+To view the decrypted content, please log into QuMail with the recipient email address.{attachment_info}
+
+Encrypted Content Hash: {hash_prefix}...
+
+QuMail Team"""
+
 class EmailClient:
     """Email client for sending and receiving secure emails"""
     
@@ -27,6 +55,14 @@ class EmailClient:
         self.imap_port = getattr(config, 'IMAP_PORT', 993)
         self.system_email = getattr(config, 'SYSTEM_EMAIL', None)
         self.system_password = getattr(config, 'SYSTEM_EMAIL_PASSWORD', None)
+        # How far back inbox searches go (0 searches the whole mailbox)
+        self.imap_search_days = int(getattr(config, 'IMAP_SEARCH_DAYS', 30))
+        
+        # Pool of authenticated SMTP connections, reused across single and bulk sends
+        self.max_connections = int(getattr(config, 'SMTP_MAX_CONNECTIONS', 4))
+        self.messages_per_connection = int(getattr(config, 'SMTP_MESSAGES_PER_CONNECTION', 100))
+        self._smtp_pool = queue.Queue(maxsize=self.max_connections)
+        atexit.register(self.close)
         
         # Check if credentials are configured
         if not self.system_email or not self.system_password:
@@ -75,83 +111,102 @@ class EmailClient:
             logger.info(f"Would include {len(email_data.get('attachments'))} attachment(s)")
         return True
     
+    def _build_mime(self, email_data: Dict[str, Any]) -> MIMEMultipart:
+        """Build the MIME message (body plus attachments) for a secure email"""
+        msg = MIMEMultipart()
+        
+        # Use the actual sender if provided, fallback to system email
+        sender_email = email_data.get('sender', self.system_email)
+        msg['From'] = f"{sender_email} (via QuMail)"
+        msg['To'] = email_data.get('recipient')
+        msg['Subject'] = email_data.get('subject')
+        
+        # Create email body with sender information
+        encrypted_hash = email_data.get('encrypted_content', '')
+        if isinstance(encrypted_hash, bytes):
+            encrypted_hash = encrypted_hash.hex()
+        
+        attachments = email_data.get('attachments', [])
+        attachment_info = ""
+        if attachments:
+            attachment_info = f"\n\nAttachments ({len(attachments)} files):\n" + "\n".join([f"- {os.path.basename(att) if isinstance(att, str) else att.get('filename', 'Unknown')}" for att in attachments])
+        
+        body = _BODY_TEMPLATE.format(
+            sender=sender_email,
+            recipient=email_data.get('recipient'),
+            attachment_info=attachment_info,
+            hash_prefix=encrypted_hash[:50]
+        )
+        
+        msg.attach(MIMEText(body, 'plain'))
+        
+        # Handle file attachments
+        if attachments:
+            logger.info(f"Processing {len(attachments)} attachments")
+            for attachment in attachments:
+                try:
+                    if isinstance(attachment, str):  # File path
+                        if os.path.exists(attachment):
+                            self._attach_streamed(msg, attachment, os.path.basename(attachment))
+                            logger.info(f"Attached file: {os.path.basename(attachment)}")
+                    elif isinstance(attachment, dict):  # File data dict
+                        # 'data' is raw bytes, or base64 text when 'encoding' is 'base64'
+                        filename = attachment.get('filename', 'attachment')
+                        file_data = attachment.get('data', b'')
+                        if file_data:
+                            pre_encoded = attachment.get('encoding') == 'base64'
+                            self._attach_streamed(msg, file_data, filename, pre_encoded=pre_encoded)
+                            logger.info(f"Attached file: {filename}")
+                except Exception as e:
+                    logger.warning(f"Failed to attach file: {e}")
+        
+        return msg
+    
+    def _attach_streamed(self, msg: MIMEMultipart, source, filename: str, pre_encoded: bool = False):
+        """
+        Attach a file to msg, base64 encoding it chunk by chunk
+        
+        Args:
+            msg: Message to attach to
+            source: File path, or the file contents as bytes
+            filename: Name shown for the attachment
+            pre_encoded: source is already base64 (str or bytes); it is only
+                re-wrapped to MIME line length, never encoded a second time
+        """
+        encoded = []
+        if pre_encoded:
+            text = source.decode('ascii') if isinstance(source, (bytes, bytearray)) else source
+            compact = ''.join(text.split())
+            encoded = [(compact[start:start + 76] + '\n').encode('ascii') for start in range(0, len(compact), 76)]
+        elif isinstance(source, (bytes, bytearray)):
+            view = memoryview(source)
+            for start in range(0, len(view), _ATTACHMENT_CHUNK_SIZE):
+                encoded.append(base64.encodebytes(view[start:start + _ATTACHMENT_CHUNK_SIZE]))
+        else:
+            with open(source, "rb") as f:
+                while chunk := f.read(_ATTACHMENT_CHUNK_SIZE):
+                    encoded.append(base64.encodebytes(chunk))
+        
+        part = MIMEBase('application', 'octet-stream')
+        # Payload is already encoded, so set the header instead of encoders.encode_base64
+        part.set_payload(b''.join(encoded).decode('ascii'))
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition', f'attachment; filename= {filename}')
+        msg.attach(part)
+    
     def _send_real_email(self, email_data: Dict[str, Any]) -> bool:
         """Send actual email via SMTP"""
+        # Fail before any MIME building or SMTP traffic
+        missing = [field for field in _REQUIRED_FIELDS if not email_data.get(field)]
+        if missing:
+            logger.error(f"Not sending email, missing {', '.join(missing)}")
+            return False
+        
         try:
-            msg = MIMEMultipart()
-            
-            # Use the actual sender if provided, fallback to system email
             sender_email = email_data.get('sender', self.system_email)
-            msg['From'] = f"{sender_email} (via QuMail)"
-            msg['To'] = email_data.get('recipient')
-            msg['Subject'] = email_data.get('subject')
-            
-            # Create email body with sender information
-            encrypted_hash = email_data.get('encrypted_content', '')
-            if isinstance(encrypted_hash, bytes):
-                encrypted_hash = encrypted_hash.hex()
-            
-            attachments = email_data.get('attachments', [])
-            attachment_info = ""
-            if attachments:
-                attachment_info = f"\n\nAttachments ({len(attachments)} files):\n" + "\n".join([f"- {os.path.basename(att) if isinstance(att, str) else att.get('filename', 'Unknown')}" for att in attachments])
-            
-            body = f"""This is a secure email sent via QuMail - Quantum Secure Email Client.
-
-From: {sender_email}
-To: {email_data.get('recipient')}
-
-The content has been encrypted using quantum encryption and stored on IPFS.
-To view the decrypted content, please log into QuMail with the recipient email address.{attachment_info}
-
-Encrypted Content Hash: {encrypted_hash[:50]}...
-
-QuMail Team"""
             
-            msg.attach(MIMEText(body, 'plain'))
-            
-            # Handle file attachments
-            if attachments:
-                logger.info(f"Processing {len(attachments)} attachments")
-                for attachment in attachments:
-                    try:
-                        if isinstance(attachment, str):  # File path
-                            if os.path.exists(attachment):
-                                with open(attachment, "rb") as f:
-                                    part = MIMEBase('application', 'octet-stream')
-                                    part.set_payload(f.read())
-                                    encoders.encode_base64(part)
-                                    part.add_header(
-                                        'Content-Disposition',
-                                        f'attachment; filename= {os.path.basename(attachment)}'
-                                    )
-                                    msg.attach(part)
-                                    logger.info(f"Attached file: {os.path.basename(attachment)}")
-                        elif isinstance(attachment, dict):  # File data dict
-                            filename = attachment.get('filename', 'attachment')
-                            file_data = attachment.get('data', b'')
-                            if file_data:
-                                part = MIMEBase('application', 'octet-stream')
-                                part.set_payload(file_data)
-                                encoders.encode_base64(part)
-                                part.add_header(
-                                    'Content-Disposition',
-                                    f'attachment; filename= {filename}'
-                                )
-                                msg.attach(part)
-                                logger.info(f"Attached file: {filename}")
-                    except Exception as e:
-                        logger.warning(f"Failed to attach file: {e}")
-            
-            # Connect to SMTP server
-            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            server.starttls()
-            server.login(self.system_email, self.system_password)
-            
-            # Send email
-            text = msg.as_string()
-            server.sendmail(self.system_email, email_data.get('recipient'), text)
-            server.quit()
+            # Send over a pooled SMTP session so concurrent requests don't queue on one connection
+            self._send_pooled(email_data)
             
             logger.info(f"Email sent successfully from {sender_email} to {email_data.get('recipient')}")
             return True
@@ -160,6 +215,111 @@ QuMail Team"""
             logger.error(f"Failed to send real email: {e}")
             return False
     
+    def _connect_smtp(self) -> smtplib.SMTP:
+        """Open and authenticate a new SMTP connection"""
+        server = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=30)
+        server.starttls()
+        server.login(self.system_email, self.system_password)
+        return server
+    
+    @staticmethod
+    def _quit_quietly(server: smtplib.SMTP):
+        """Close an SMTP connection, ignoring errors from one that is already dead"""
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+    
+    def close(self):
+        """Close the pooled SMTP connections"""
+        while True:
+            try:
+                server, _ = self._smtp_pool.get_nowait()
+            except queue.Empty:
+                break
+            self._quit_quietly(server)
+    
+    def send_secure_emails_bulk(self, email_data_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Send many secure emails in parallel over a bounded pool of SMTP connections
+        
+        Args:
+            email_data_list: List of email_data dicts as accepted by send_secure_email
+            
+        Returns:
+            One result dict per email, in the same order
+        """
+        if not email_data_list:
+            return []
+        
+        if not self.system_email or not self.system_password:
+            logger.error("Email credentials not configured")
+            return [{'success': False, 'error': 'Email credentials not configured'} for _ in email_data_list]
+        
+        workers = min(self.max_connections, len(email_data_list))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self._send_pooled, email_data) for email_data in email_data_list]
+        
+        results = []
+        for email_data, future in zip(email_data_list, futures):
+            try:
+                future.result()
+                results.append({'success': True, 'message': 'Email sent successfully'})
+            except Exception as e:
+                logger.error(f"Failed to send email to {email_data.get('recipient')}: {e}")
+                results.append({'success': False, 'error': str(e)})
+        
+        sent = sum(1 for result in results if result['success'])
+        logger.info(f"Bulk send finished: {sent}/{len(results)} emails sent")
+        return results
+    
+    def _send_pooled(self, email_data: Dict[str, Any]):
+        """Send one email using a connection checked out of the pool"""
+        missing = [field for field in _REQUIRED_FIELDS if not email_data.get(field)]
+        if missing:
+            raise ValueError(f"Missing {', '.join(missing)}")
+        
+        msg = self._build_mime(email_data)
+        to_addrs = [email_data.get('recipient')]
+        
+        try:
+            server, sent = self._smtp_pool.get_nowait()
+            reused = True
+        except queue.Empty:
+            server, sent = self._connect_smtp(), 0
+            reused = False
+        
+        # send_message flattens straight to bytes, skipping the as_string() copy
+        try:
+            server.send_message(msg, from_addr=self.system_email, to_addrs=to_addrs)
+        except smtplib.SMTPServerDisconnected:
+            self._quit_quietly(server)
+            if not reused:
+                raise
+            # An idle pooled connection the server already closed fails on
+            # MAIL FROM, before any message data went out, so resending is safe
+            logger.warning("Pooled SMTP connection was closed by the server, retrying on a new connection")
+            server, sent = self._connect_smtp(), 0
+            try:
+                server.send_message(msg, from_addr=self.system_email, to_addrs=to_addrs)
+            except Exception:
+                self._quit_quietly(server)
+                raise
+        except Exception:
+            # Don't hand a connection in an unknown state to the next sender
+            self._quit_quietly(server)
+            raise
+        sent += 1
+        
+        # Return the connection unless it has done its share of messages
+        if sent >= self.messages_per_connection:
+            self._quit_quietly(server)
+        else:
+            try:
+                self._smtp_pool.put_nowait((server, sent))
+            except queue.Full:
+                self._quit_quietly(server)
+    
     def get_inbox_emails(self, limit: int = 20) -> List[Dict[str, Any]]:
         """Get inbox emails"""
         try:
@@ -199,6 +359,49 @@ QuMail Team"""
             logger.error(f"Failed to get inbox: {e}")
             return []
     
+    def _parse_header_fetch(self, msg_data: list) -> List[Dict[str, Any]]:
+        """
+        Turn a batched header FETCH response into inbox entries, oldest first
+        
+        imaplib returns one (envelope, header bytes) tuple per message,
+        interleaved with b')' terminators.
+        """
+        header_parser = BytesHeaderParser()
+        emails = []
+        
+        for item in msg_data:
+            if not isinstance(item, tuple):
+                continue
+            try:
+                uid_match = _IMAP_UID_RE.search(item[0])
+                if not uid_match:
+                    continue
+                
+                # Parse headers only
+                email_message = header_parser.parsebytes(item[1])
+                
+                # Extract email info
+                sender = email_message['From']
+                subject = email_message['Subject']
+                date = email_message['Date']
+                
+                emails.append({
+                    'id': int(uid_match.group(1)),
+                    'sender': sender,
+                    'subject': subject or '(No Subject)',
+                    'timestamp': date or 'Unknown',
+                    'encrypted': '[QuMail]' in (subject or ''),
+                    'read': False  # Simplified - in real implementation, track read status
+                })
+                
+            except Exception as e:
+                logger.warning(f"Failed to parse email {item[0]!r}: {e}")
+                continue
+        
+        # Servers may answer a UID set in any order
+        emails.sort(key=lambda e: e['id'])
+        return emails
+    
     def _get_real_emails(self, limit: int = 20) -> List[Dict[str, Any]]:
         """Get real emails from IMAP server"""
         try:
@@ -207,44 +410,24 @@ QuMail Team"""
             mail.login(self.system_email, self.system_password)
             mail.select('inbox')
             
-            # Search for emails
-            result, messages = mail.search(None, 'ALL')
+            # Search server-side by UID, restricted to recent mail
+            if self.imap_search_days > 0:
+                since = (datetime.utcnow() - timedelta(days=self.imap_search_days)).strftime('%d-%b-%Y')
+                result, messages = mail.uid('search', None, 'SINCE', since)
+            else:
+                result, messages = mail.uid('search', None, 'ALL')
             
             if result != 'OK':
                 return []
             
-            emails = []
-            message_ids = messages[0].split()
+            message_ids = messages[0].split()[-limit:]
+            if not message_ids:
+                mail.logout()
+                return []
             
-            # Get latest emails (limited by limit parameter)
-            for msg_id in message_ids[-limit:]:
-                try:
-                    result, msg_data = mail.fetch(msg_id, '(RFC822)')
-                    
-                    if result != 'OK':
-                        continue
-                    
-                    # Parse email
-                    email_body = msg_data[0][1]
-                    email_message = email.message_from_bytes(email_body)
-                    
-                    # Extract email info
-                    sender = email_message['From']
-                    subject = email_message['Subject']
-                    date = email_message['Date']
-                    
-                    emails.append({
-                        'id': int(msg_id),
-                        'sender': sender,
-                        'subject': subject or '(No Subject)',
-                        'timestamp': date or 'Unknown',
-                        'encrypted': '[QuMail]' in (subject or ''),
-                        'read': False  # Simplified - in real implementation, track read status
-                    })
-                    
-                except Exception as e:
-                    logger.warning(f"Failed to parse email {msg_id}: {e}")
-                    continue
+            # One FETCH for the whole UID set instead of a round trip per message
+            result, msg_data = mail.uid('fetch', b','.join(message_ids), _IMAP_HEADER_FETCH)
+            emails = self._parse_header_fetch(msg_data) if result == 'OK' else []
             
             mail.close()
             mail.logout()
@@ -9,6 +9,8 @@ import hashlib
 import secrets
 import json
 import threading
+import time
+from functools import lru_cache
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional, List
 from pathlib import Path
@@ -17,6 +19,26 @@ from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 import base64
 
+@lru_cache(maxsize=8)
+def _derive_storage_key(password: bytes, salt: bytes) -> bytes:
+    """Run PBKDF2 once per (password, salt) pair and share the result across instances"""
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=100000,
+    )
+    return base64.urlsafe_b64encode(kdf.derive(password))
+
+def _hash_hex(value) -> Optional[str]:
+    """Hex form of a stored key hash (raw digest, or hex text from older rows)"""
+    if isinstance(value, bytes):
+        return value.hex()
+    return value
+
+# Rows expired per transaction in cleanup_expired_keys
+_CLEANUP_BATCH_SIZE = 10000
+
 class EmbeddedKeyManager:
     """
     Local Key Manager that runs embedded within the QuMail client
@@ -27,28 +49,56 @@ class EmbeddedKeyManager:
         self.config = config
         self.db_path = os.path.join(config.LOCAL_DATA_PATH, 'keys.db')
         self.encryption_key = self._derive_encryption_key()
+        self._fernet = Fernet(self.encryption_key)
         self._lock = threading.Lock()
+        self._local = threading.local()
+        self._qgen = None
         self._initialize_database()
     
+    @property
+    def quantum_generator(self):
+        """
+        Shared QuantumKeyGenerator, created on first use
+        
+        The generator keeps no per-call state, so one instance is safe to
+        use from several threads without locking.
+        """
+        if self._qgen is None:
+            from key_manager.quantum.key_generator import QuantumKeyGenerator
+            self._qgen = QuantumKeyGenerator()
+        return self._qgen
+    
     def _derive_encryption_key(self) -> bytes:
         """Derive encryption key from password for local key storage"""
         password = self.config.KEY_ENCRYPTION_PASSWORD.encode() if self.config.KEY_ENCRYPTION_PASSWORD else b'default_password_change_me'
         salt = b'qumail_salt_2025'  # In production, use random salt stored securely
         
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(password))
-        return key
+        return _derive_storage_key(password, salt)
+    
+    def _get_conn(self) -> sqlite3.Connection:
+        """
+        Get this thread's SQLite connection, opening it on first use
+        
+        Connections stay open for the life of the thread (and are reopened
+        after a fork) so the page cache and parsed statements are reused.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            conn.execute('PRAGMA mmap_size=268435456')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
     
     def _initialize_database(self):
         """Initialize local SQLite database for key storage"""
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
         
-        with sqlite3.connect(self.db_path) as conn:
+        with self._get_conn() as conn:
             conn.execute('''
                 CREATE TABLE IF NOT EXISTS quantum_keys (
                     key_id TEXT PRIMARY KEY,
@@ -59,9 +109,10 @@ class EmbeddedKeyManager:
                     used_by TEXT,
                     used_at TEXT,
                     expiry_time TEXT,
+                    expiry_time_epoch INTEGER,
                     quantum_protocol TEXT DEFAULT 'BB84',
                     key_length INTEGER NOT NULL,
-                    hash_sha256 TEXT NOT NULL
+                    hash_sha256 BLOB NOT NULL
                 )
             ''')
             
@@ -75,25 +126,54 @@ class EmbeddedKeyManager:
                 )
             ''')
             
+            # Migrate databases created before expiry_time_epoch existed
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(quantum_keys)')}
+            if 'expiry_time_epoch' not in columns:
+                conn.execute('ALTER TABLE quantum_keys ADD COLUMN expiry_time_epoch INTEGER')
+                conn.execute('''
+                    UPDATE quantum_keys
+                    SET expiry_time_epoch = CAST(strftime('%s', expiry_time) AS INTEGER)
+                    WHERE expiry_time IS NOT NULL
+                ''')
+            
+            # Older databases stored hash_sha256 as hex text; store raw 32-byte digests
+            hex_rows = conn.execute(
+                "SELECT key_id, hash_sha256 FROM quantum_keys WHERE typeof(hash_sha256) = 'text'"
+            ).fetchall()
+            if hex_rows:
+                conn.executemany(
+                    'UPDATE quantum_keys SET hash_sha256 = ? WHERE key_id = ?',
+                    [(bytes.fromhex(row['hash_sha256']), row['key_id']) for row in hex_rows]
+                )
+            
+            # get_user_keys: filter by user (and optionally status), newest first
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_keys_user_ts ON quantum_keys(created_for, timestamp DESC)
+            ''')
+            
             conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_keys_status ON quantum_keys(status)
+                CREATE INDEX IF NOT EXISTS idx_keys_user_status_ts ON quantum_keys(created_for, status, timestamp DESC)
             ''')
             
+            # cleanup_expired_keys: only unused keys can expire
             conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_keys_user ON quantum_keys(created_for)
+                CREATE INDEX IF NOT EXISTS idx_keys_expiry_epoch ON quantum_keys(expiry_time_epoch) WHERE status = 'unused'
             ''')
             
+            # Subsumed by the indexes above
+            conn.execute('DROP INDEX IF EXISTS idx_keys_expiry')
+            conn.execute('DROP INDEX IF EXISTS idx_keys_status')
+            conn.execute('DROP INDEX IF EXISTS idx_keys_user')
+            
             conn.commit()
     
     def _encrypt_key_bytes(self, key_bytes: bytes) -> bytes:
         """Encrypt key bytes for secure local storage"""
-        fernet = Fernet(self.encryption_key)
-        return fernet.encrypt(key_bytes)
+        return self._fernet.encrypt(key_bytes)
     
     def _decrypt_key_bytes(self, encrypted_bytes: bytes) -> bytes:
         """Decrypt key bytes from local storage"""
-        fernet = Fernet(self.encryption_key)
-        return fernet.decrypt(encrypted_bytes)
+        return self._fernet.decrypt(encrypted_bytes)
     
     def generate_quantum_key(self, user_id: str, key_length: int = None) -> Dict[str, Any]:
         """
@@ -106,42 +186,41 @@ class EmbeddedKeyManager:
         Returns:
             Dictionary containing key information
         """
-        with self._lock:
-            try:
-                key_length = key_length or self.config.DEFAULT_KEY_LENGTH
-                
-                # Validate key length
-                if key_length < self.config.MIN_KEY_LENGTH or key_length > self.config.MAX_KEY_LENGTH:
-                    raise ValueError(f"Key length must be between {self.config.MIN_KEY_LENGTH} and {self.config.MAX_KEY_LENGTH}")
-                
-                # Generate quantum key using the quantum key generator
-                from key_manager.quantum.key_generator import QuantumKeyGenerator
-                quantum_gen = QuantumKeyGenerator()
-                
-                key_bytes, metadata = quantum_gen.generate_key_with_verification(
-                    length_bytes=key_length,
-                    protocol=self.config.QUANTUM_PROTOCOL
-                )
-                
-                # Generate unique key ID
-                key_id = self._generate_key_id(user_id, key_bytes)
-                
-                # Calculate expiry time
-                expiry_time = datetime.utcnow() + timedelta(hours=self.config.KEY_EXPIRY_HOURS)
-                
-                # Calculate hash
-                key_hash = hashlib.sha256(key_bytes).hexdigest()
-                
-                # Encrypt key bytes for storage
-                encrypted_key_bytes = self._encrypt_key_bytes(key_bytes)
-                
-                # Store in database
-                with sqlite3.connect(self.db_path) as conn:
+        try:
+            key_length = key_length or self.config.DEFAULT_KEY_LENGTH
+            
+            # Validate key length
+            if key_length < self.config.MIN_KEY_LENGTH or key_length > self.config.MAX_KEY_LENGTH:
+                raise ValueError(f"Key length must be between {self.config.MIN_KEY_LENGTH} and {self.config.MAX_KEY_LENGTH}")
+            
+            # Generate quantum key using the quantum key generator
+            key_bytes, metadata = self.quantum_generator.generate_key_with_verification(
+                length_bytes=key_length,
+                protocol=self.config.QUANTUM_PROTOCOL
+            )
+            
+            # Generate unique key ID
+            key_id = self._generate_key_id(user_id, key_bytes)
+            
+            # Calculate expiry time
+            expiry_time = datetime.utcnow() + timedelta(hours=self.config.KEY_EXPIRY_HOURS)
+            expiry_epoch = int(time.time()) + self.config.KEY_EXPIRY_HOURS * 3600
+            
+            # Calculate hash
+            key_digest = hashlib.sha256(key_bytes).digest()
+            key_hash = key_digest.hex()
+            
+            # Encrypt key bytes for storage
+            encrypted_key_bytes = self._encrypt_key_bytes(key_bytes)
+            
+            # Store in database
+            with self._lock:
+                with self._get_conn() as conn:
                     conn.execute('''
                         INSERT INTO quantum_keys 
                         (key_id, encrypted_key_bytes, status, timestamp, created_for, 
-                         expiry_time, quantum_protocol, key_length, hash_sha256)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                         expiry_time, expiry_time_epoch, quantum_protocol, key_length, hash_sha256)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                     ''', (
                         key_id,
                         encrypted_key_bytes,
@@ -149,9 +228,10 @@ class EmbeddedKeyManager:
                         datetime.utcnow().isoformat(),
                         user_id,
                         expiry_time.isoformat(),
+                        expiry_epoch,
                         self.config.QUANTUM_PROTOCOL,
                         key_length,
-                        key_hash
+                        key_digest
                     ))
                     
                     # Store metadata
@@ -161,20 +241,101 @@ class EmbeddedKeyManager:
                     ''', (key_id, json.dumps(metadata)))
                     
                     conn.commit()
+            
+            return {
+                'key_id': key_id,
+                'status': 'unused',
+                'key_length': key_length,
+                'hash': key_hash,
+                'timestamp': datetime.utcnow().isoformat(),
+                'expiry_time': expiry_time.isoformat(),
+                'quantum_protocol': self.config.QUANTUM_PROTOCOL,
+                'metadata': metadata
+            }
+            
+        except Exception as e:
+            raise Exception(f"Error generating quantum key: {e}")
+    
+    def generate_quantum_keys_batch(self, user_id: str, count: int, key_length: int = None) -> List[Dict[str, Any]]:
+        """
+        Generate several quantum keys and store them in a single transaction
+        
+        Args:
+            user_id: User identifier
+            count: Number of keys to generate
+            key_length: Length of each key in bytes (default from config)
+            
+        Returns:
+            List of key information dictionaries, in generation order
+        """
+        try:
+            key_length = key_length or self.config.DEFAULT_KEY_LENGTH
+            
+            # Validate key length
+            if key_length < self.config.MIN_KEY_LENGTH or key_length > self.config.MAX_KEY_LENGTH:
+                raise ValueError(f"Key length must be between {self.config.MIN_KEY_LENGTH} and {self.config.MAX_KEY_LENGTH}")
+            
+            quantum_gen = self.quantum_generator
+            protocol = self.config.QUANTUM_PROTOCOL
+            timestamp = datetime.utcnow().isoformat()
+            expiry_time = (datetime.utcnow() + timedelta(hours=self.config.KEY_EXPIRY_HOURS)).isoformat()
+            expiry_epoch = int(time.time()) + self.config.KEY_EXPIRY_HOURS * 3600
+            
+            key_rows = []
+            metadata_rows = []
+            keys = []
+            for _ in range(count):
+                key_bytes, metadata = quantum_gen.generate_key_with_verification(
+                    length_bytes=key_length,
+                    protocol=protocol
+                )
+                key_id = self._generate_key_id(user_id, key_bytes)
+                key_digest = hashlib.sha256(key_bytes).digest()
+                key_hash = key_digest.hex()
                 
-                return {
+                key_rows.append((
+                    key_id,
+                    self._encrypt_key_bytes(key_bytes),
+                    'unused',
+                    timestamp,
+                    user_id,
+                    expiry_time,
+                    expiry_epoch,
+                    protocol,
+                    key_length,
+                    key_digest
+                ))
+                metadata_rows.append((key_id, json.dumps(metadata)))
+                keys.append({
                     'key_id': key_id,
                     'status': 'unused',
                     'key_length': key_length,
                     'hash': key_hash,
-                    'timestamp': datetime.utcnow().isoformat(),
-                    'expiry_time': expiry_time.isoformat(),
-                    'quantum_protocol': self.config.QUANTUM_PROTOCOL,
+                    'timestamp': timestamp,
+                    'expiry_time': expiry_time,
+                    'quantum_protocol': protocol,
                     'metadata': metadata
-                }
-                
-            except Exception as e:
-                raise Exception(f"Error generating quantum key: {e}")
+                })
+            
+            # One transaction and one commit for the whole batch
+            with self._lock:
+                with self._get_conn() as conn:
+                    conn.executemany('''
+                        INSERT INTO quantum_keys 
+                        (key_id, encrypted_key_bytes, status, timestamp, created_for, 
+                         expiry_time, expiry_time_epoch, quantum_protocol, key_length, hash_sha256)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', key_rows)
+                    
+                    conn.executemany('''
+                        INSERT INTO key_metadata (key_id, metadata_json)
+                        VALUES (?, ?)
+                    ''', metadata_rows)
+            
+            return keys
+            
+        except Exception as e:
+            raise Exception(f"Error generating quantum keys: {e}")
     
     def get_quantum_key(self, key_id: str, user_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -187,49 +348,49 @@ class EmbeddedKeyManager:
         Returns:
             Dictionary containing key data or None if not found
         """
-        with self._lock:
-            try:
-                with sqlite3.connect(self.db_path) as conn:
-                    conn.row_factory = sqlite3.Row
-                    cursor = conn.execute('''
-                        SELECT * FROM quantum_keys 
-                        WHERE key_id = ? AND created_for = ?
-                    ''', (key_id, user_id))
-                    
-                    row = cursor.fetchone()
-                    if not row:
-                        return None
-                    
-                    # Check if key is expired
-                    expiry_time = datetime.fromisoformat(row['expiry_time'])
-                    if datetime.utcnow() > expiry_time and row['status'] == 'unused':
-                        # Mark as expired
-                        conn.execute('''
-                            UPDATE quantum_keys 
-                            SET status = 'expired' 
-                            WHERE key_id = ?
-                        ''', (key_id,))
-                        conn.commit()
-                        return None
-                    
-                    # Check if already used
-                    if row['status'] in ['used', 'expired']:
-                        return None
-                    
-                    # Decrypt key bytes
-                    key_bytes = self._decrypt_key_bytes(row['encrypted_key_bytes'])
-                    
-                    return {
-                        'key_id': row['key_id'],
-                        'key_bytes': key_bytes,
-                        'status': row['status'],
-                        'timestamp': row['timestamp'],
-                        'key_length': row['key_length'],
-                        'hash': row['hash_sha256']
-                    }
-                    
-            except Exception as e:
-                raise Exception(f"Error retrieving quantum key: {e}")
+        # No manager lock: under WAL this thread's connection reads without
+        # blocking on writers, and the rare expiry UPDATE is guarded in SQL
+        try:
+            with self._get_conn() as conn:
+                # Expiry is evaluated by SQLite in the same statement
+                cursor = conn.execute('''
+                    SELECT key_id, encrypted_key_bytes, status, timestamp, key_length, hash_sha256,
+                           (status = 'unused' AND expiry_time_epoch < ?) AS is_expired
+                    FROM quantum_keys 
+                    WHERE key_id = ? AND created_for = ?
+                ''', (int(time.time()), key_id, user_id))
+                
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                
+                if row['is_expired']:
+                    # Mark as expired; the guard keeps a concurrent mark_key_used intact
+                    conn.execute('''
+                        UPDATE quantum_keys 
+                        SET status = 'expired' 
+                        WHERE key_id = ? AND status = 'unused'
+                    ''', (key_id,))
+                    return None
+                
+                # Check if already used
+                if row['status'] in ['used', 'expired']:
+                    return None
+                
+                # Decrypt key bytes
+                key_bytes = self._decrypt_key_bytes(row['encrypted_key_bytes'])
+                
+                return {
+                    'key_id': row['key_id'],
+                    'key_bytes': key_bytes,
+                    'status': row['status'],
+                    'timestamp': row['timestamp'],
+                    'key_length': row['key_length'],
+                    'hash': _hash_hex(row['hash_sha256'])
+                }
+                
+        except Exception as e:
+            raise Exception(f"Error retrieving quantum key: {e}")
     
     def mark_key_used(self, key_id: str, used_by: str) -> bool:
         """
@@ -244,7 +405,7 @@ class EmbeddedKeyManager:
         """
         with self._lock:
             try:
-                with sqlite3.connect(self.db_path) as conn:
+                with self._get_conn() as conn:
                     cursor = conn.execute('''
                         UPDATE quantum_keys 
                         SET status = 'used', used_by = ?, used_at = ?
@@ -268,13 +429,13 @@ class EmbeddedKeyManager:
             Hash string or None if not found
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._get_conn() as conn:
                 cursor = conn.execute('''
                     SELECT hash_sha256 FROM quantum_keys WHERE key_id = ?
                 ''', (key_id,))
                 
                 row = cursor.fetchone()
-                return row[0] if row else None
+                return _hash_hex(row[0]) if row else None
                 
         except Exception as e:
             raise Exception(f"Error getting key hash: {e}")
@@ -292,9 +453,7 @@ class EmbeddedKeyManager:
             List of key dictionaries
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                
+            with self._get_conn() as conn:
                 if status:
                     cursor = conn.execute('''
                         SELECT key_id, status, timestamp, key_length, hash_sha256, 
@@ -321,7 +480,7 @@ class EmbeddedKeyManager:
                         'status': row['status'],
                         'timestamp': row['timestamp'],
                         'key_length': row['key_length'],
-                        'hash': row['hash_sha256'],
+                        'hash': _hash_hex(row['hash_sha256']),
                         'quantum_protocol': row['quantum_protocol'],
                         'expiry_time': row['expiry_time'],
                         'used_by': row['used_by'],
@@ -340,22 +499,31 @@ class EmbeddedKeyManager:
         Returns:
             Number of keys marked as expired
         """
-        with self._lock:
-            try:
-                current_time = datetime.utcnow().isoformat()
+        try:
+            current_time = int(time.time())
+            total = 0
+            
+            # Expire in bounded batches so each write transaction (and the
+            # lock) is held briefly, letting other writers in between
+            while True:
+                with self._lock:
+                    with self._get_conn() as conn:
+                        cursor = conn.execute('''
+                            UPDATE quantum_keys 
+                            SET status = 'expired'
+                            WHERE rowid IN (
+                                SELECT rowid FROM quantum_keys
+                                WHERE status = 'unused' AND expiry_time_epoch < ?
+                                LIMIT ?
+                            )
+                        ''', (current_time, _CLEANUP_BATCH_SIZE))
                 
-                with sqlite3.connect(self.db_path) as conn:
-                    cursor = conn.execute('''
-                        UPDATE quantum_keys 
-                        SET status = 'expired'
-                        WHERE status = 'unused' AND expiry_time < ?
-                    ''', (current_time,))
-                    
-                    conn.commit()
-                    return cursor.rowcount
-                    
-            except Exception as e:
-                raise Exception(f"Error cleaning up expired keys: {e}")
+                total += cursor.rowcount
+                if cursor.rowcount < _CLEANUP_BATCH_SIZE:
+                    return total
+                
+        except Exception as e:
+            raise Exception(f"Error cleaning up expired keys: {e}")
     
     def store_blockchain_hash(self, key_id: str, tx_hash: str) -> bool:
         """
@@ -369,7 +537,7 @@ class EmbeddedKeyManager:
             True if successful, False otherwise
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._get_conn() as conn:
                 cursor = conn.execute('''
                     UPDATE key_metadata 
                     SET blockchain_tx_hash = ?, verification_status = 'verified'
@@ -384,14 +552,13 @@ class EmbeddedKeyManager:
     
     def _generate_key_id(self, user_id: str, key_bytes: bytes) -> str:
         """Generate unique key ID"""
-        timestamp = datetime.utcnow().isoformat()
-        data = f"{user_id}:{timestamp}:{len(key_bytes)}:{secrets.token_hex(16)}"
-        return 'K' + hashlib.sha256(data.encode()).hexdigest()[:31]  # K + 31 chars = 32 total
+        # 124 random bits straight from secrets; hashing them added nothing
+        return 'K' + secrets.token_hex(16)[:31]  # K + 31 chars = 32 total
     
     def get_statistics(self) -> Dict[str, Any]:
         """Get key manager statistics"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._get_conn() as conn:
                 cursor = conn.execute('''
                     SELECT 
                         COUNT(*) as total_keys,
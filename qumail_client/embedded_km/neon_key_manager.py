@@ -7,22 +7,293 @@ import os
 import logging
 import json
 import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 import base64
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
 import uuid
 import hashlib
+import hmac
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+try:
+    import redis
+except ImportError:
+    redis = None
+
 logger = logging.getLogger(__name__)
 
+# Leading byte of AES-GCM key_data_encrypted blobs; Fernet tokens start with 0x80.
+# Version 2 is keyed with HKDF, version 1 (and Fernet) with the older PBKDF2 key
+_AESGCM_VERSION = b'\x02'
+_AESGCM_PBKDF2_VERSION = b'\x01'
+_AESGCM_NONCE_SIZE = 12
+_KDF_SALT = b'qumail_neon_salt_2024'
+
+@lru_cache(maxsize=8)
+def _derive_key_bytes(secret: bytes, salt: bytes) -> bytes:
+    """HKDF the KM secret into the key-data encryption key"""
+    # KM_SECRET_KEY is a server-side random secret, not a guessable password,
+    # so a single HKDF extract/expand is enough
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        info=b'qumail-key-data-aesgcm',
+    ).derive(secret)
+
+@lru_cache(maxsize=8)
+def _derive_legacy_key_bytes(password: bytes, salt: bytes) -> bytes:
+    """PBKDF2 key used for key data written before the switch to HKDF"""
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=100000,
+    )
+    return kdf.derive(password)
+
+# Rows fetched per round trip when streaming from a server-side cursor
+_STREAM_ITERSIZE = 200
+
+# Rows deactivated per transaction by cleanup_expired_keys
+_CLEANUP_BATCH_SIZE = 10000
+
+# Email listing fields holding datetimes, stored as ISO strings when cached
+_EMAIL_TIME_FIELDS = ('timestamp', 'sent_at')
+
+def _emails_to_json(emails: list) -> list:
+    """Make email dicts JSON-serializable for the Redis cache"""
+    return [
+        {k: (v.isoformat() if k in _EMAIL_TIME_FIELDS and v is not None else v) for k, v in email.items()}
+        for email in emails
+    ]
+
+def _emails_from_json(emails: list) -> list:
+    """Restore email dicts read back from the Redis cache"""
+    for email in emails:
+        for k in _EMAIL_TIME_FIELDS:
+            if email.get(k):
+                email[k] = datetime.fromisoformat(email[k])
+    return emails
+
+# A session used this recently is assumed alive; a failed send reconnects anyway
+_SMTP_NOOP_AFTER = 30
+
+# Argon2id for account passwords; encoded hashes carry their own salt and parameters
+_PASSWORD_HASHER = PasswordHasher(time_cost=3, memory_cost=64 * 1024, parallelism=2,
+                                  hash_len=32, salt_len=16)
+_ARGON2_PREFIX = '$argon2'
+
+# Schema setup runs once per process, on first database use
+_DB_INITIALIZED = False
+_DB_INIT_LOCK = threading.Lock()
+
+# Idempotent schema setup, run by NeonKeyManager._init_database
+_SCHEMA_DDL = """
+-- Create quantum_keys table (one row per key per user it is shared with)
+CREATE TABLE IF NOT EXISTS quantum_keys (
+    key_id VARCHAR(255) NOT NULL DEFAULT gen_random_uuid()::text,
+    user_id VARCHAR(255) NOT NULL,
+    recipient VARCHAR(255),
+    purpose VARCHAR(255),
+    key_data_encrypted BYTEA NOT NULL,
+    key_length INTEGER NOT NULL,
+    quantum_protocol VARCHAR(50) DEFAULT 'BB84',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP,
+    is_active BOOLEAN DEFAULT TRUE,
+    usage_count INTEGER DEFAULT 0,
+    max_usage INTEGER DEFAULT 1,
+    metadata JSONB,
+    PRIMARY KEY (key_id, user_id)
+);
+
+-- Older tables keyed on key_id alone can't hold shared copies, and the
+-- ON CONFLICT (key_id, user_id) used when sharing needs this key
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_index
+        WHERE indrelid = 'quantum_keys'::regclass AND indisprimary AND indnatts = 1
+    ) THEN
+        ALTER TABLE quantum_keys DROP CONSTRAINT quantum_keys_pkey;
+        ALTER TABLE quantum_keys ADD PRIMARY KEY (key_id, user_id);
+    END IF;
+END $$;
+
+-- Key data used to be stored as base64 text; keep the raw ciphertext instead
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'quantum_keys'
+        AND column_name = 'key_data_encrypted'
+        AND data_type = 'text'
+    ) THEN
+        ALTER TABLE quantum_keys ALTER COLUMN key_data_encrypted TYPE BYTEA
+        USING decode(key_data_encrypted, 'base64');
+    END IF;
+END $$;
+
+-- Key IDs are assigned by the server (gen_random_uuid is built in from PostgreSQL 13)
+ALTER TABLE quantum_keys ALTER COLUMN key_id SET DEFAULT gen_random_uuid()::text;
+
+-- Create indexes
+CREATE INDEX IF NOT EXISTS idx_quantum_keys_user_id 
+ON quantum_keys(user_id);
+
+-- Reads and cleanup only look at active keys, so keep deactivated rows out of these indexes
+CREATE INDEX IF NOT EXISTS idx_quantum_keys_active_user 
+ON quantum_keys(user_id, created_at DESC) WHERE is_active = TRUE;
+
+DROP INDEX IF EXISTS idx_quantum_keys_expires_at;
+CREATE INDEX IF NOT EXISTS idx_quantum_keys_active_expires 
+ON quantum_keys(expires_at) WHERE is_active = TRUE;
+
+-- Create email statistics table
+CREATE TABLE IF NOT EXISTS email_statistics (
+    id SERIAL PRIMARY KEY,
+    user_id VARCHAR(255) NOT NULL,
+    email_type VARCHAR(20) NOT NULL CHECK (email_type IN ('sent', 'received')),
+    recipient VARCHAR(255),
+    sender VARCHAR(255),
+    subject VARCHAR(500),
+    ipfs_hash VARCHAR(100),
+    encryption_key_id VARCHAR(255),
+    encrypted_content TEXT,
+    sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Create user accounts table
+CREATE TABLE IF NOT EXISTS user_accounts (
+    id SERIAL PRIMARY KEY,
+    email VARCHAR(255) UNIQUE NOT NULL,
+    password_hash VARCHAR(255) NOT NULL,
+    is_verified BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_login TIMESTAMP,
+    failed_login_attempts INTEGER DEFAULT 0,
+    account_locked_until TIMESTAMP,
+    password_reset_token VARCHAR(255),
+    password_reset_expires TIMESTAMP
+);
+
+-- Create OTP verification table
+CREATE TABLE IF NOT EXISTS otp_verification (
+    id SERIAL PRIMARY KEY,
+    email VARCHAR(255) NOT NULL,
+    otp_code VARCHAR(10) NOT NULL,
+    purpose VARCHAR(50) NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    is_used BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    password_hash VARCHAR(255)  -- For storing temp password hash during registration
+);
+
+-- Add encrypted_content column if it doesn't exist (for existing tables)
+ALTER TABLE email_statistics 
+ADD COLUMN IF NOT EXISTS encrypted_content TEXT;
+
+-- Add password_hash column to otp_verification if it doesn't exist
+ALTER TABLE otp_verification 
+ADD COLUMN IF NOT EXISTS password_hash VARCHAR(255);
+
+-- One pending OTP per email, so a new code can replace the old one with an upsert.
+-- Older tables may hold several rows per email; keep only the newest
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_indexes
+        WHERE schemaname = current_schema() AND indexname = 'idx_otp_verification_email'
+    ) THEN
+        DELETE FROM otp_verification a
+        USING otp_verification b
+        WHERE a.email = b.email AND a.id < b.id;
+        CREATE UNIQUE INDEX idx_otp_verification_email ON otp_verification(email);
+    END IF;
+END $$;
+
+-- Create indexes separately (PostgreSQL syntax)
+-- Newest-first per user and type; each inbox arm is an ordered index scan.
+-- It also serves every lookup the old user_id-only index did
+CREATE INDEX IF NOT EXISTS idx_email_stats_user_type_sent 
+ON email_statistics(user_id, email_type, sent_at DESC);
+
+DROP INDEX IF EXISTS idx_email_stats_user_id;
+
+CREATE INDEX IF NOT EXISTS idx_email_stats_sent_at 
+ON email_statistics(sent_at);
+"""
+
+# Hot-path statements, built once so every call sends byte-identical text
+# (psycopg caches the parsed query and auto-prepares on that text)
+_SQL_GET_KEY = """
+    UPDATE quantum_keys 
+    SET usage_count = usage_count + 1
+    WHERE key_id = %s AND user_id = %s AND is_active = TRUE
+    AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)
+    RETURNING key_id, user_id, recipient, purpose, key_data_encrypted,
+              key_length, created_at, expires_at, usage_count,
+              quantum_protocol, metadata
+"""
+
+_KEY_LISTING_COLUMNS = """key_id, user_id, recipient, purpose, key_length,
+           created_at, expires_at, usage_count, quantum_protocol,
+           is_active, metadata"""
+_EXPIRED_COLUMN = "(expires_at IS NOT NULL AND expires_at <= CURRENT_TIMESTAMP) AS expired"
+_ACTIVE_FILTER = """is_active = TRUE 
+    AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)"""
+
+# get_user_keys statements keyed by (include_expired, decrypt_keys)
+_SQL_USER_KEYS = {
+    (include_expired, decrypt_keys): f"""
+    SELECT {_KEY_LISTING_COLUMNS}{", key_data_encrypted" if decrypt_keys else ""},
+           {_EXPIRED_COLUMN if include_expired else "FALSE AS expired"}
+    FROM quantum_keys 
+    WHERE user_id = %s{"" if include_expired else " AND " + _ACTIVE_FILTER}
+    ORDER BY created_at DESC
+"""
+    for include_expired in (True, False)
+    for decrypt_keys in (True, False)
+}
+
+# get_key_by_id statements keyed by include_expired
+_SQL_KEY_BY_ID = {
+    include_expired: f"""
+    SELECT {_KEY_LISTING_COLUMNS}, key_data_encrypted,
+           {_EXPIRED_COLUMN if include_expired else "FALSE AS expired"}
+    FROM quantum_keys 
+    WHERE key_id = %s AND user_id = %s{"" if include_expired else " AND " + _ACTIVE_FILTER}
+    ORDER BY created_at DESC
+    LIMIT 1
+"""
+    for include_expired in (True, False)
+}
+
+@dataclass(slots=True)
+class InboxPage:
+    """One page of a user's inbox plus their sent/received totals"""
+    emails: list = field(default_factory=list)
+    sent_count: int = 0
+    received_count: int = 0
+
 class NeonKeyManager:
     """
     Quantum Key Manager using Neon Database for cloud storage            server.sendmail(sender_email, email, text)
@@ -47,143 +318,242 @@ class NeonKeyManager:
         self.database_url = config.DATABASE_URL
         self.secret_key = config.KM_SECRET_KEY
         
-        # Initialize encryption for key data
-        self._init_encryption()
+        # Connection pool, opened on first use (and reopened in forked workers)
+        self.pool_size = int(getattr(config, 'DB_POOL_SIZE', 10) or 10)
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        
+        # Key metadata is identical for every generated key, serialize it once
+        self._key_metadata_json = json.dumps({
+            'quantum_protocol': getattr(config, 'QUANTUM_PROTOCOL', 'BB84'),
+            'created_by': 'neon_key_manager',
+            'version': '1.0'
+        })
+        
+        # Key encryption and the schema are set up on first use, so
+        # constructing the manager costs no KDF run or round trip
+        self._aead = None
+        self._legacy_aead = None
+        self._cipher_suite = None
         
-        # Initialize database
-        self._init_database()
+        # Persistent authenticated SMTP session for OTP mail, opened on first send
+        self._smtp = None
+        self._smtp_last_used = 0.0
+        self._smtp_lock = threading.Lock()
+        
+        # Background sender for OTP mail, started on first use (and restarted in forked workers)
+        self._otp_executor = None
+        self._otp_executor_pid = None
+        self._otp_executor_lock = threading.Lock()
+        
+        # Optional Redis cache for read-heavy lookups
+        self.email_stats_cache_ttl = int(getattr(config, 'EMAIL_STATS_CACHE_TTL', 60))
+        self.email_list_cache_ttl = int(getattr(config, 'EMAIL_LIST_CACHE_TTL', 60))
+        self._redis = self._init_redis()
         
         logger.info("Neon Key Manager initialized with cloud storage")
     
+    def _init_redis(self):
+        """Create the Redis client if REDIS_URL is set and redis is installed"""
+        redis_url = getattr(self.config, 'REDIS_URL', '')
+        if not redis_url:
+            return None
+        if redis is None:
+            logger.warning("REDIS_URL is set but the redis package is not installed, caching disabled")
+            return None
+        # redis-py connects lazily and resets its pool in forked workers
+        return redis.Redis.from_url(redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+    
+    def _cache_get(self, key: str):
+        """Return a cached JSON value, or None on a miss or Redis error"""
+        if self._redis is None:
+            return None
+        try:
+            cached = self._redis.get(key)
+            return json.loads(cached) if cached is not None else None
+        except Exception as e:
+            logger.warning(f"Redis get {key} failed: {e}")
+            return None
+    
+    def _cache_set(self, key: str, value, ttl: int):
+        """Store a JSON value in Redis for ttl seconds, ignoring Redis errors"""
+        if self._redis is None:
+            return
+        try:
+            self._redis.setex(key, ttl, json.dumps(value))
+        except Exception as e:
+            logger.warning(f"Redis set {key} failed: {e}")
+    
+    def _cache_hget(self, key: str, field: str):
+        """Return a cached JSON value stored in a Redis hash field, or None"""
+        if self._redis is None:
+            return None
+        try:
+            cached = self._redis.hget(key, field)
+            return json.loads(cached) if cached is not None else None
+        except Exception as e:
+            logger.warning(f"Redis hget {key} failed: {e}")
+            return None
+    
+    def _cache_hset(self, key: str, field: str, value, ttl: int):
+        """Store a JSON value in a Redis hash field and refresh the hash's TTL"""
+        if self._redis is None:
+            return
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.hset(key, field, json.dumps(value))
+            pipe.expire(key, ttl)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Redis hset {key} failed: {e}")
+    
+    def _cache_delete(self, *keys: str):
+        """Drop cached values, ignoring Redis errors"""
+        if self._redis is None or not keys:
+            return
+        try:
+            self._redis.delete(*keys)
+        except Exception as e:
+            logger.warning(f"Redis delete failed: {e}")
+    
+    def _invalidate_email_caches(self, *user_ids: str):
+        """Forget cached email statistics and listings after a user's emails change"""
+        keys = set()
+        for user_id in user_ids:
+            keys.update((f"qumail:stats:{user_id}", f"qumail:sent:{user_id}",
+                         f"qumail:received:{user_id}"))
+        self._cache_delete(*keys)
+    
+    def _get_pool(self) -> ConnectionPool:
+        """Get the connection pool for this process, creating it if needed"""
+        if self._pool is None or self._pool_pid != os.getpid():
+            with self._pool_lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    # A pool inherited across fork shares sockets with the parent;
+                    # drop it without closing and start fresh
+                    self._pool = ConnectionPool(
+                        self.database_url,
+                        min_size=2,
+                        max_size=self.pool_size,
+                        # Let Neon's idle suspend close connections we no longer hold
+                        max_idle=240,
+                        kwargs={
+                            # Server-side prepare repeated statements after two runs;
+                            # the hottest ones pass prepare=True to skip the warm-up
+                            'prepare_threshold': 2,
+                            'keepalives': 1,
+                            'keepalives_idle': 30
+                        },
+                        open=True
+                    )
+                    self._pool_pid = os.getpid()
+        return self._pool
+    
+    @contextmanager
+    def _conn(self):
+        """
+        Borrow a pooled connection for one transaction
+        
+        Commits on success and rolls back on error, then returns the
+        connection to the pool (broken connections are discarded).
+        """
+        if not _DB_INITIALIZED:
+            self._init_database()
+        with self._get_pool().connection() as conn:
+            yield conn
+    
+    def close(self):
+        """Close every pooled connection and the OTP SMTP session"""
+        with self._otp_executor_lock:
+            if self._otp_executor is not None and self._otp_executor_pid == os.getpid():
+                # Let queued OTP mail go out before the SMTP session is closed
+                self._otp_executor.shutdown(wait=True)
+            self._otp_executor = None
+            self._otp_executor_pid = None
+        with self._smtp_lock:
+            self._drop_smtp()
+        with self._pool_lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.close()
+            self._pool = None
+            self._pool_pid = None
+    
     def _init_encryption(self):
         """Initialize encryption for storing key data"""
         # Derive encryption key from secret
-        password = self.secret_key.encode()
-        salt = b'qumail_neon_salt_2024'  # In production, use random salt per key
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(password))
-        self.cipher_suite = Fernet(key)
+        self._aead = AESGCM(_derive_key_bytes(self.secret_key.encode(), _KDF_SALT))
+    
+    def _init_legacy_encryption(self):
+        """Initialize the PBKDF2-keyed ciphers needed to read older rows"""
+        derived = _derive_legacy_key_bytes(self.secret_key.encode(), _KDF_SALT)
+        self._legacy_aead = AESGCM(derived)
+        self._cipher_suite = Fernet(base64.urlsafe_b64encode(derived))
+    
+    @property
+    def aead(self) -> AESGCM:
+        """AES-GCM cipher for key data, derived on first access"""
+        if self._aead is None:
+            self._init_encryption()
+        return self._aead
+    
+    @property
+    def legacy_aead(self) -> AESGCM:
+        """AES-GCM cipher for version 1 key data, derived on first access"""
+        if self._legacy_aead is None:
+            self._init_legacy_encryption()
+        return self._legacy_aead
+    
+    @property
+    def cipher_suite(self) -> Fernet:
+        """Fernet cipher for legacy key data, derived on first access"""
+        if self._cipher_suite is None:
+            self._init_legacy_encryption()
+        return self._cipher_suite
+    
+    def _encrypt_key_data(self, key_data: bytes) -> bytes:
+        """Encrypt key bytes for storage as version || nonce || ciphertext+tag"""
+        nonce = os.urandom(_AESGCM_NONCE_SIZE)
+        return _AESGCM_VERSION + nonce + self.aead.encrypt(nonce, key_data, None)
+    
+    def _decrypt_key_data(self, stored: bytes) -> bytes:
+        """Decrypt a key_data_encrypted value (AES-GCM, or a legacy Fernet token)"""
+        blob = bytes(stored)
+        version = blob[:1]
+        if version in (_AESGCM_VERSION, _AESGCM_PBKDF2_VERSION):
+            aead = self.aead if version == _AESGCM_VERSION else self.legacy_aead
+            nonce_end = 1 + _AESGCM_NONCE_SIZE
+            return aead.decrypt(blob[1:nonce_end], blob[nonce_end:], None)
+        return self.cipher_suite.decrypt(blob)
     
     def _init_database(self):
-        """Initialize database tables"""
-        try:
-            with psycopg2.connect(self.database_url) as conn:
-                with conn.cursor() as cur:
-                    # Create quantum_keys table
-                    cur.execute("""
-                        CREATE TABLE IF NOT EXISTS quantum_keys (
-                            key_id VARCHAR(255) PRIMARY KEY,
-                            user_id VARCHAR(255) NOT NULL,
-                            recipient VARCHAR(255),
-                            purpose VARCHAR(255),
-                            key_data_encrypted TEXT NOT NULL,
-                            key_length INTEGER NOT NULL,
-                            quantum_protocol VARCHAR(50) DEFAULT 'BB84',
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            expires_at TIMESTAMP,
-                            is_active BOOLEAN DEFAULT TRUE,
-                            usage_count INTEGER DEFAULT 0,
-                            max_usage INTEGER DEFAULT 1,
-                            metadata JSONB
-                        );
-                    """)
-                    
-                    # Create indexes
-                    cur.execute("""
-                        CREATE INDEX IF NOT EXISTS idx_quantum_keys_user_id 
-                        ON quantum_keys(user_id);
-                    """)
-                    
-                    cur.execute("""
-                        CREATE INDEX IF NOT EXISTS idx_quantum_keys_expires_at 
-                        ON quantum_keys(expires_at);
-                    """)
-                    
-                    # Create email statistics table
-                    cur.execute("""
-                        CREATE TABLE IF NOT EXISTS email_statistics (
-                            id SERIAL PRIMARY KEY,
-                            user_id VARCHAR(255) NOT NULL,
-                            email_type VARCHAR(20) NOT NULL CHECK (email_type IN ('sent', 'received')),
-                            recipient VARCHAR(255),
-                            sender VARCHAR(255),
-                            subject VARCHAR(500),
-                            ipfs_hash VARCHAR(100),
-                            encryption_key_id VARCHAR(255),
-                            encrypted_content TEXT,
-                            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        );
-                    """)
-                    
-                    # Create user accounts table
-                    cur.execute("""
-                        CREATE TABLE IF NOT EXISTS user_accounts (
-                            id SERIAL PRIMARY KEY,
-                            email VARCHAR(255) UNIQUE NOT NULL,
-                            password_hash VARCHAR(255) NOT NULL,
-                            is_verified BOOLEAN DEFAULT FALSE,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            last_login TIMESTAMP,
-                            failed_login_attempts INTEGER DEFAULT 0,
-                            account_locked_until TIMESTAMP,
-                            password_reset_token VARCHAR(255),
-                            password_reset_expires TIMESTAMP
-                        );
-                    """)
-                    
-                    # Create OTP verification table
-                    cur.execute("""
-                        CREATE TABLE IF NOT EXISTS otp_verification (
-                            id SERIAL PRIMARY KEY,
-                            email VARCHAR(255) NOT NULL,
-                            otp_code VARCHAR(10) NOT NULL,
-                            purpose VARCHAR(50) NOT NULL,
-                            expires_at TIMESTAMP NOT NULL,
-                            is_used BOOLEAN DEFAULT FALSE,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            password_hash VARCHAR(255)  -- For storing temp password hash during registration
-                        );
-                    """)
-                    
-                    # Add encrypted_content column if it doesn't exist (for existing tables)
-                    cur.execute("""
-                        ALTER TABLE email_statistics 
-                        ADD COLUMN IF NOT EXISTS encrypted_content TEXT;
-                    """)
-                    
-                    # Add password_hash column to otp_verification if it doesn't exist
-                    cur.execute("""
-                        ALTER TABLE otp_verification 
-                        ADD COLUMN IF NOT EXISTS password_hash VARCHAR(255);
-                    """)
-                    
-                    # Create indexes separately (PostgreSQL syntax)
-                    cur.execute("""
-                        CREATE INDEX IF NOT EXISTS idx_email_stats_user_id 
-                        ON email_statistics(user_id);
-                    """)
-                    
-                    cur.execute("""
-                        CREATE INDEX IF NOT EXISTS idx_email_stats_sent_at 
-                        ON email_statistics(sent_at);
-                    """)
-                    
-                    conn.commit()
-                    logger.info("Database tables initialized successfully")
-                    
-        except Exception as e:
-            logger.error(f"Failed to initialize database: {e}")
-            raise
+        """Initialize database tables (once per process)"""
+        global _DB_INITIALIZED
+        with _DB_INIT_LOCK:
+            if _DB_INITIALIZED:
+                return
+            try:
+                with self._get_pool().connection() as conn:
+                    with conn.cursor() as cur:
+                        # Serialize migrations across workers; the lock is
+                        # released when this transaction commits
+                        cur.execute("SELECT pg_advisory_xact_lock(hashtext('qumail_schema'))")
+                        # Every statement is idempotent; send them as one simple query
+                        # (one round trip) and never as a prepared statement
+                        cur.execute(_SCHEMA_DDL, prepare=False)
+                        
+                        conn.commit()
+                        _DB_INITIALIZED = True
+                        logger.info("Database tables initialized successfully")
+                        
+            except Exception as e:
+                logger.error(f"Failed to initialize database: {e}")
+                raise
     
     def test_connection(self):
         """Test database connection"""
         try:
-            with psycopg2.connect(self.database_url) as conn:
+            with self._conn() as conn:
                 with conn.cursor() as cur:
                     cur.execute("SELECT 1")
                     return True
@@ -212,38 +582,34 @@ class NeonKeyManager:
             
             # Generate quantum key using secure random
             key_data = secrets.token_bytes(key_length)
-            key_id = str(uuid.uuid4())
             
             # Calculate expiry
             expiry_hours = getattr(self.config, 'KEY_EXPIRY_HOURS', 24)
             expires_at = datetime.utcnow() + timedelta(hours=expiry_hours)
             
-            # Encrypt key data for storage
-            encrypted_key_data = self.cipher_suite.encrypt(key_data)
-            encrypted_key_str = base64.b64encode(encrypted_key_data).decode()
+            # Encrypt key data for storage (sent as raw BYTEA)
+            encrypted_key_data = self._encrypt_key_data(key_data)
             
             # Store in database
-            with psycopg2.connect(self.database_url) as conn:
+            with self._conn() as conn:
                 with conn.cursor() as cur:
+                    # key_id comes from the column default
                     cur.execute("""
                         INSERT INTO quantum_keys 
-                        (key_id, user_id, recipient, purpose, key_data_encrypted, 
+                        (user_id, recipient, purpose, key_data_encrypted, 
                          key_length, expires_at, metadata)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s)
+                        RETURNING key_id
                     """, (
-                        key_id,
                         user_id,
                         recipient,
                         purpose,
-                        encrypted_key_str,
+                        encrypted_key_data,
                         key_length,
                         expires_at,
-                        json.dumps({
-                            'quantum_protocol': getattr(self.config, 'QUANTUM_PROTOCOL', 'BB84'),
-                            'created_by': 'neon_key_manager',
-                            'version': '1.0'
-                        })
+                        self._key_metadata_json
                     ))
+                    key_id = cur.fetchone()[0]
                     conn.commit()
             
             logger.info(f"Generated quantum key {key_id} for user {user_id}")
@@ -276,34 +642,18 @@ class NeonKeyManager:
             Key data dictionary or None if not found
         """
         try:
-            with psycopg2.connect(self.database_url) as conn:
-                with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                    cur.execute("""
-                        SELECT * FROM quantum_keys 
-                        WHERE key_id = %s AND user_id = %s AND is_active = TRUE
-                    """, (key_id, user_id))
+            with self._conn() as conn:
+                with conn.cursor(row_factory=dict_row) as cur:
+                    # Check access and expiry and count the use in one round trip
+                    cur.execute(_SQL_GET_KEY, (key_id, user_id), prepare=True)
                     
                     row = cur.fetchone()
                     
                     if not row:
                         return None
                     
-                    # Check if key has expired
-                    if row['expires_at'] and datetime.utcnow() > row['expires_at']:
-                        logger.warning(f"Key {key_id} has expired")
-                        return None
-                    
                     # Decrypt key data
-                    encrypted_data = base64.b64decode(row['key_data_encrypted'])
-                    key_data = self.cipher_suite.decrypt(encrypted_data)
-                    
-                    # Update usage count
-                    cur.execute("""
-                        UPDATE quantum_keys 
-                        SET usage_count = usage_count + 1
-                        WHERE key_id = %s
-                    """, (key_id,))
-                    conn.commit()
+                    key_data = self._decrypt_key_data(row['key_data_encrypted'])
                     
                     return {
                         'key_id': row['key_id'],
@@ -314,7 +664,7 @@ class NeonKeyManager:
                         'purpose': row['purpose'],
                         'created_at': row['created_at'].isoformat() if row['created_at'] else None,
                         'expires_at': row['expires_at'].isoformat() if row['expires_at'] else None,
-                        'usage_count': row['usage_count'] + 1,
+                        'usage_count': row['usage_count'],
                         'quantum_protocol': row['quantum_protocol'],
                         'metadata': row['metadata']
                     }
@@ -323,79 +673,85 @@ class NeonKeyManager:
             logger.error(f"Failed to get key {key_id}: {e}")
             raise
     
-    def get_user_keys(self, user_id: str, include_expired: bool = False) -> List[Dict[str, Any]]:
+    def get_user_keys(self, user_id: str, include_expired: bool = False,
+                      decrypt_keys: bool = False) -> List[Dict[str, Any]]:
         """
         Get all keys for a user from Neon database
         
         Args:
             user_id: User identifier
             include_expired: Whether to include expired keys
+            decrypt_keys: Whether to fetch and decrypt key_data; listings only
+                need metadata, so by default key_data is None
             
         Returns:
             List of key dictionaries
         """
         try:
-            with psycopg2.connect(self.database_url) as conn:
-                with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                    if include_expired:
-                        cur.execute("""
-                            SELECT key_id, user_id, recipient, purpose, key_length,
-                                   created_at, expires_at, usage_count, quantum_protocol,
-                                   is_active, metadata, key_data_encrypted
-                            FROM quantum_keys 
-                            WHERE user_id = %s 
-                            ORDER BY created_at DESC
-                        """, (user_id,))
-                    else:
-                        cur.execute("""
-                            SELECT key_id, user_id, recipient, purpose, key_length,
-                                   created_at, expires_at, usage_count, quantum_protocol,
-                                   is_active, metadata, key_data_encrypted
-                            FROM quantum_keys 
-                            WHERE user_id = %s AND is_active = TRUE 
-                            AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)
-                            ORDER BY created_at DESC
-                        """, (user_id,))
+            with self._conn() as conn:
+                with conn.cursor(row_factory=dict_row) as cur:
+                    # The encrypted blob is only read off the wire when it will be decrypted
+                    cur.execute(_SQL_USER_KEYS[(bool(include_expired), bool(decrypt_keys))],
+                                (user_id,), prepare=True)
                     
                     rows = cur.fetchall()
                     
-                    keys = []
-                    for row in rows:
-                        # Check if key is expired
-                        expired = (row['expires_at'] and 
-                                 datetime.utcnow() > row['expires_at'])
-                        
-                        # Decrypt key data
-                        key_data = None
-                        if row['key_data_encrypted']:
-                            try:
-                                encrypted_key_data = base64.b64decode(row['key_data_encrypted'])
-                                key_data = self.cipher_suite.decrypt(encrypted_key_data)
-                            except Exception as e:
-                                logger.error(f"Failed to decrypt key data for {row['key_id']}: {e}")
-                        
-                        keys.append({
-                            'key_id': row['key_id'],
-                            'key_data': key_data,
-                            'user_id': row['user_id'],
-                            'recipient': row['recipient'],
-                            'purpose': row['purpose'],
-                            'key_length': row['key_length'],
-                            'created_at': row['created_at'].isoformat() if row['created_at'] else None,
-                            'expires_at': row['expires_at'].isoformat() if row['expires_at'] else None,
-                            'usage_count': row['usage_count'],
-                            'quantum_protocol': row['quantum_protocol'],
-                            'is_active': row['is_active'],
-                            'expired': expired,
-                            'metadata': row['metadata']
-                        })
-                    
-                    return keys
+                    return [self._format_key_row(row) for row in rows]
                     
         except Exception as e:
             logger.error(f"Failed to get user keys for {user_id}: {e}")
             raise
     
+    def get_key_by_id(self, key_id: str, user_id: str, include_expired: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Get a single key owned by (or shared with) a user
+        
+        Args:
+            key_id: Key identifier
+            user_id: User identifier
+            include_expired: Whether to return expired/inactive keys
+            
+        Returns:
+            Key dictionary (same shape as get_user_keys entries) or None
+        """
+        try:
+            with self._conn() as conn:
+                with conn.cursor(row_factory=dict_row) as cur:
+                    cur.execute(_SQL_KEY_BY_ID[bool(include_expired)], (key_id, user_id), prepare=True)
+                    
+                    row = cur.fetchone()
+                    return self._format_key_row(row) if row else None
+                    
+        except Exception as e:
+            logger.error(f"Failed to get key {key_id} for {user_id}: {e}")
+            raise
+    
+    def _format_key_row(self, row) -> Dict[str, Any]:
+        """Build the key dictionary returned to callers from a quantum_keys row"""
+        # Decrypt key data
+        key_data = None
+        if row.get('key_data_encrypted'):
+            try:
+                key_data = self._decrypt_key_data(row['key_data_encrypted'])
+            except Exception as e:
+                logger.error(f"Failed to decrypt key data for {row['key_id']}: {e}")
+        
+        return {
+            'key_id': row['key_id'],
+            'key_data': key_data,
+            'user_id': row['user_id'],
+            'recipient': row['recipient'],
+            'purpose': row['purpose'],
+            'key_length': row['key_length'],
+            'created_at': row['created_at'].isoformat() if row['created_at'] else None,
+            'expires_at': row['expires_at'].isoformat() if row['expires_at'] else None,
+            'usage_count': row['usage_count'],
+            'quantum_protocol': row['quantum_protocol'],
+            'is_active': row['is_active'],
+            'expired': row['expired'],
+            'metadata': row['metadata']
+        }
+    
     def delete_key(self, key_id: str, user_id: str) -> bool:
         """
         Delete a quantum key from Neon database
@@ -408,7 +764,7 @@ class NeonKeyManager:
             True if deleted successfully
         """
         try:
-            with psycopg2.connect(self.database_url) as conn:
+            with self._conn() as conn:
                 with conn.cursor() as cur:
                     # Soft delete - mark as inactive
                     cur.execute("""
@@ -443,41 +799,33 @@ class NeonKeyManager:
             True if successful
         """
         try:
-            with psycopg2.connect(self.database_url) as conn:
-                with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                    # Get the original key
+            with self._conn() as conn:
+                with conn.cursor() as cur:
+                    # Copy the sender's row for the recipient with the same key_id, so
+                    # both can decrypt, in one round trip. The outer SELECT reports
+                    # whether the sender's key existed (an existing copy is not an error)
                     cur.execute("""
-                        SELECT key_data_encrypted, key_length, quantum_protocol, 
-                               expires_at, purpose, metadata
-                        FROM quantum_keys
-                        WHERE key_id = %s AND user_id = %s AND is_active = TRUE
-                    """, (key_id, sender_id))
-                    
-                    key_row = cur.fetchone()
-                    if not key_row:
+                        WITH source AS (
+                            SELECT key_id, purpose, key_data_encrypted, key_length,
+                                   quantum_protocol, expires_at, metadata
+                            FROM quantum_keys
+                            WHERE key_id = %s AND user_id = %s AND is_active = TRUE
+                        ), shared AS (
+                            INSERT INTO quantum_keys 
+                            (key_id, user_id, recipient, purpose, key_data_encrypted, 
+                             key_length, quantum_protocol, expires_at, metadata)
+                            SELECT key_id, %s, %s, COALESCE(purpose, 'shared_for_decryption'),
+                                   key_data_encrypted, key_length, quantum_protocol, expires_at, metadata
+                            FROM source
+                            ON CONFLICT (key_id, user_id) DO NOTHING
+                        )
+                        SELECT COUNT(*) FROM source
+                    """, (key_id, sender_id, recipient_id, sender_id))
+                    
+                    if not cur.fetchone()[0]:
                         logger.error(f"Key {key_id} not found for sender {sender_id}")
                         return False
                     
-                    # Create a copy for the recipient with the same key_id
-                    # This allows both sender and recipient to decrypt using the same key
-                    cur.execute("""
-                        INSERT INTO quantum_keys 
-                        (key_id, user_id, recipient, purpose, key_data_encrypted, 
-                         key_length, quantum_protocol, expires_at, metadata)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (key_id, user_id) DO NOTHING
-                    """, (
-                        key_id,  # Same key_id
-                        recipient_id,  # Different user
-                        sender_id,  # Track who shared it
-                        key_row['purpose'] or 'shared_for_decryption',
-                        key_row['key_data_encrypted'],  # Same encrypted key data
-                        key_row['key_length'],
-                        key_row['quantum_protocol'],
-                        key_row['expires_at'],
-                        json.dumps(key_row['metadata']) if isinstance(key_row['metadata'], dict) else key_row['metadata']  # Convert dict to JSON string
-                    ))
-                    
                     conn.commit()
                     logger.info(f"Shared key {key_id} from {sender_id} to {recipient_id}")
                     return True
@@ -494,17 +842,29 @@ class NeonKeyManager:
             Number of keys cleaned up
         """
         try:
-            with psycopg2.connect(self.database_url) as conn:
+            count = 0
+            with self._conn() as conn:
                 with conn.cursor() as cur:
-                    # Mark expired keys as inactive
-                    cur.execute("""
-                        UPDATE quantum_keys 
-                        SET is_active = FALSE 
-                        WHERE expires_at < CURRENT_TIMESTAMP AND is_active = TRUE
-                    """)
-                    
-                    count = cur.rowcount
-                    conn.commit()
+                    # Mark expired keys as inactive in short batches so each
+                    # transaction holds few row locks and vacuum can keep up
+                    while True:
+                        cur.execute("""
+                            UPDATE quantum_keys 
+                            SET is_active = FALSE 
+                            WHERE ctid IN (
+                                SELECT ctid FROM quantum_keys
+                                WHERE expires_at < CURRENT_TIMESTAMP AND is_active = TRUE
+                                LIMIT %s
+                                FOR UPDATE SKIP LOCKED
+                            )
+                        """, (_CLEANUP_BATCH_SIZE,))
+                        
+                        batch = cur.rowcount
+                        conn.commit()
+                        count += batch
+                        
+                        if batch < _CLEANUP_BATCH_SIZE:
+                            break
                     
                     if count > 0:
                         logger.info(f"Cleaned up {count} expired keys")
@@ -526,7 +886,7 @@ class NeonKeyManager:
             Statistics dictionary
         """
         try:
-            with psycopg2.connect(self.database_url) as conn:
+            with self._conn() as conn:
                 with conn.cursor() as cur:
                     if user_id:
                         cur.execute("""
@@ -563,120 +923,252 @@ class NeonKeyManager:
     
     def record_email_sent(self, user_id: str, recipient: str, subject: str, ipfs_hash: str, encryption_key_id: str, encrypted_content: str = None):
         """Record a sent email for statistics"""
+        if self.record_emails([(user_id, 'sent', recipient, None, subject, ipfs_hash, encryption_key_id, encrypted_content)]):
+            logger.info(f"Recorded sent email for user {user_id}")
+    
+    def record_email_received(self, user_id: str, sender: str, subject: str, ipfs_hash: str, encryption_key_id: str = None, encrypted_content: str = None):
+        """Record a received email for statistics"""
+        if self.record_emails([(user_id, 'received', None, sender, subject, ipfs_hash, encryption_key_id, encrypted_content)]):
+            logger.info(f"Recorded received email for user {user_id} from {sender}")
+    
+    def record_emails(self, rows: list) -> int:
+        """
+        Record many sent/received emails in one transaction
+        
+        Args:
+            rows: Tuples of (user_id, email_type, recipient, sender, subject,
+                  ipfs_hash, encryption_key_id, encrypted_content)
+            
+        Returns:
+            Number of rows recorded (0 on failure)
+        """
+        if not rows:
+            return 0
         try:
-            with psycopg2.connect(self.database_url) as conn:
+            with self._conn() as conn:
                 with conn.cursor() as cur:
-                    cur.execute("""
+                    # psycopg pipelines executemany, so the batch costs one round trip
+                    cur.executemany("""
                         INSERT INTO email_statistics 
-                        (user_id, email_type, recipient, subject, ipfs_hash, encryption_key_id, encrypted_content)
-                        VALUES (%s, 'sent', %s, %s, %s, %s, %s)
-                    """, (user_id, recipient, subject, ipfs_hash, encryption_key_id, encrypted_content))
+                        (user_id, email_type, recipient, sender, subject, ipfs_hash, encryption_key_id, encrypted_content)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                    """, rows)
                     conn.commit()
-                    logger.info(f"Recorded sent email for user {user_id}")
+            self._invalidate_email_caches(*(row[0] for row in rows))
+            return len(rows)
         except Exception as e:
-            logger.error(f"Failed to record sent email: {e}")
+            logger.error(f"Failed to record {len(rows)} email(s): {e}")
+            return 0
     
-    def record_email_received(self, user_id: str, sender: str, subject: str, ipfs_hash: str, encryption_key_id: str = None, encrypted_content: str = None):
-        """Record a received email for statistics"""
+    def record_and_share(self, sender: str, recipient: str, subject: str, ipfs_hash: str,
+                         encryption_key_id: str, encrypted_content: str = None,
+                         share_key: bool = True) -> bool:
+        """
+        Record a delivered email for both parties and share its key in one transaction
+        
+        Args:
+            sender: User who sent the email (and owns the key)
+            recipient: User who received the email
+            subject: Email subject
+            ipfs_hash: IPFS hash of the stored email
+            encryption_key_id: Key used to encrypt the email
+            encrypted_content: Base64 encoded ciphertext
+            share_key: Also copy the key to the recipient so they can decrypt
+            
+        Returns:
+            True if successful
+        """
         try:
-            with psycopg2.connect(self.database_url) as conn:
+            with self._conn() as conn:
                 with conn.cursor() as cur:
-                    cur.execute("""
-                        INSERT INTO email_statistics 
-                        (user_id, email_type, sender, subject, ipfs_hash, encryption_key_id, encrypted_content)
-                        VALUES (%s, 'received', %s, %s, %s, %s, %s)
-                    """, (user_id, sender, subject, ipfs_hash, encryption_key_id, encrypted_content))
+                    # The two inserts don't depend on each other; pipeline them so
+                    # the transaction costs one round trip instead of two
+                    with conn.pipeline():
+                        if share_key:
+                            # Copy the sender's key row for the recipient, same key_id
+                            cur.execute("""
+                                INSERT INTO quantum_keys 
+                                (key_id, user_id, recipient, purpose, key_data_encrypted, 
+                                 key_length, quantum_protocol, expires_at, metadata)
+                                SELECT key_id, %s, user_id, COALESCE(purpose, 'shared_for_decryption'),
+                                       key_data_encrypted, key_length, quantum_protocol, expires_at, metadata
+                                FROM quantum_keys
+                                WHERE key_id = %s AND user_id = %s AND is_active = TRUE
+                                ON CONFLICT (key_id, user_id) DO NOTHING
+                            """, (recipient, encryption_key_id, sender))
+                        
+                        cur.execute("""
+                            INSERT INTO email_statistics 
+                            (user_id, email_type, recipient, sender, subject, ipfs_hash, encryption_key_id, encrypted_content)
+                            VALUES (%s, 'sent', %s, NULL, %s, %s, %s, %s),
+                                   (%s, 'received', NULL, %s, %s, %s, %s, %s)
+                        """, (sender, recipient, subject, ipfs_hash, encryption_key_id, encrypted_content,
+                              recipient, sender, subject, ipfs_hash, encryption_key_id, encrypted_content))
                     conn.commit()
-                    logger.info(f"Recorded received email for user {user_id} from {sender}")
+            
+            self._invalidate_email_caches(sender, recipient)
+            logger.info(f"Recorded email from {sender} to {recipient} (key {encryption_key_id} shared: {share_key})")
+            return True
+            
         except Exception as e:
-            logger.error(f"Failed to record received email: {e}")
+            logger.error(f"Failed to record and share email: {e}")
+            return False
     
     def get_user_inbox(self, user_id: str, limit: int = 20) -> list:
         """Get all emails for a user (both sent and received)"""
         try:
-            with psycopg2.connect(self.database_url) as conn:
-                with conn.cursor() as cur:
-                    # Get both sent and received emails
-                    cur.execute("""
-                        (SELECT id, 'sent' as type, recipient as other_party, subject, 
-                                ipfs_hash, encryption_key_id, encrypted_content, sent_at as timestamp, 
-                                recipient as recipient, %s as sender
-                         FROM email_statistics 
-                         WHERE user_id = %s AND email_type = 'sent')
-                        UNION ALL
-                        (SELECT id, 'received' as type, sender as other_party, subject, 
-                                ipfs_hash, encryption_key_id, encrypted_content, sent_at as timestamp, 
-                                %s as recipient, sender
-                         FROM email_statistics 
-                         WHERE user_id = %s AND email_type = 'received')
-                        ORDER BY timestamp DESC
-                        LIMIT %s
-                    """, (user_id, user_id, user_id, user_id, limit))
-                    
-                    emails = []
-                    for row in cur.fetchall():
-                        email = {
-                            'id': row[0],
-                            'type': row[1],
-                            'other_party': row[2],
-                            'subject': row[3],
-                            'ipfs_hash': row[4],
-                            'encryption_key_id': row[5],
-                            'encrypted_content': row[6],
-                            'timestamp': row[7],
-                            'recipient': row[8],
-                            'sender': row[9]
-                        }
-                        emails.append(email)
-                    
-                    logger.info(f"Retrieved {len(emails)} emails for user {user_id}")
-                    return emails
-                    
+            emails = list(self.iter_user_inbox(user_id, limit))
+            logger.info(f"Retrieved {len(emails)} emails for user {user_id}")
+            return emails
         except Exception as e:
             logger.error(f"Failed to get user inbox: {e}")
             return []
     
-    def get_received_emails(self, user_id: str):
-        """Get emails received by user"""
+    def iter_user_inbox(self, user_id: str, limit: int = None):
+        """
+        Stream a user's sent and received emails, newest first
+        
+        Rows come from a server-side cursor in batches, so large
+        encrypted_content values are never all held in memory at once.
+        The pooled connection is held until the generator is exhausted or closed.
+        
+        Args:
+            user_id: User identifier
+            limit: Maximum number of rows (None for all)
+        """
+        with self._conn() as conn:
+            with conn.cursor(name=f"inbox_{uuid.uuid4().hex}", row_factory=dict_row) as cur:
+                cur.itersize = _STREAM_ITERSIZE
+                # Get both sent and received emails
+                cur.execute("""
+                    (SELECT id, 'sent' as type, recipient as other_party, subject, 
+                            ipfs_hash, encryption_key_id, encrypted_content, sent_at as timestamp, 
+                            recipient as recipient, %s as sender
+                     FROM email_statistics 
+                     WHERE user_id = %s AND email_type = 'sent'
+                     ORDER BY sent_at DESC
+                     LIMIT %s)
+                    UNION ALL
+                    (SELECT id, 'received' as type, sender as other_party, subject, 
+                            ipfs_hash, encryption_key_id, encrypted_content, sent_at as timestamp, 
+                            %s as recipient, sender
+                     FROM email_statistics 
+                     WHERE user_id = %s AND email_type = 'received'
+                     ORDER BY sent_at DESC
+                     LIMIT %s)
+                    ORDER BY timestamp DESC
+                    LIMIT %s
+                """, (user_id, user_id, limit, user_id, user_id, limit, limit))
+                
+                # Column aliases already match the email dict keys
+                yield from cur
+    
+    def get_inbox_page(self, user_id: str, limit: int = 50) -> InboxPage:
+        """
+        Get the most recent emails for the inbox view plus sent/received totals
+        
+        Rows are shaped for the inbox template directly in SQL so the view
+        doesn't have to post-process or count them.
+        
+        Returns:
+            InboxPage with the emails and per-type totals
+        """
         try:
-            with psycopg2.connect(self.database_url) as conn:
-                with conn.cursor() as cur:
+            with self._conn() as conn:
+                with conn.cursor(row_factory=dict_row) as cur:
                     cur.execute("""
-                        SELECT id, sender, subject, ipfs_hash, encryption_key_id, encrypted_content, 
-                               sent_at
-                        FROM email_statistics 
-                        WHERE user_id = %s AND email_type = 'received'
+                        SELECT id,
+                               email_type AS type,
+                               CASE WHEN email_type = 'sent' THEN %s ELSE sender END AS sender,
+                               CASE WHEN email_type = 'sent' THEN recipient ELSE %s END AS recipient,
+                               subject,
+                               sent_at AS timestamp,
+                               TRUE AS encrypted,
+                               COALESCE(encryption_key_id, '') AS key_id,
+                               COALESCE(ipfs_hash, '') <> '' AS has_documents
+                        FROM email_statistics
+                        WHERE user_id = %s AND email_type IN ('sent', 'received')
                         ORDER BY sent_at DESC
-                    """, (user_id,))
+                        LIMIT %s
+                    """, (user_id, user_id, user_id, limit))
+                    emails = cur.fetchall()
                     
-                    emails = []
-                    for row in cur.fetchall():
-                        email = {
-                            'id': row[0],
-                            'sender': row[1],
-                            'subject': row[2],
-                            'ipfs_hash': row[3],
-                            'key_id': row[4],
-                            'encryption_key_id': row[4],  # Add this for consistency
-                            'content': row[5],
-                            'encrypted_content': row[5],  # Add this for consistency
-                            'blockchain_hash': None,  # Not stored separately for received emails
-                            'timestamp': row[6],
-                            'sent_at': row[6]  # Add this for consistency
-                        }
-                        emails.append(email)
+                    cur.execute("""
+                        SELECT COUNT(*) FILTER (WHERE email_type = 'sent') AS sent_count,
+                               COUNT(*) FILTER (WHERE email_type = 'received') AS received_count
+                        FROM email_statistics
+                        WHERE user_id = %s
+                    """, (user_id,))
+                    counts = cur.fetchone()
                     
-                    logger.info(f"Retrieved {len(emails)} received emails for user {user_id}")
-                    return emails
+                    return InboxPage(emails, counts['sent_count'], counts['received_count'])
                     
+        except Exception as e:
+            logger.error(f"Failed to get inbox page: {e}")
+            return InboxPage()
+    
+    def get_received_emails(self, user_id: str, limit: int = None, include_content: bool = True):
+        """
+        Get emails received by user, newest first
+        
+        Args:
+            user_id: User identifier
+            limit: Maximum number of emails (None for all)
+            include_content: Include the ciphertext (content/encrypted_content);
+                listings can skip it and fetch it per email with get_email_by_id
+        
+        Only bounded listings without ciphertext are cached in Redis, so a
+        cached value stays small however large the mailbox grows.
+        """
+        cacheable = limit is not None and not include_content
+        cache_key = f"qumail:received:{user_id}"
+        if cacheable:
+            cached = self._cache_hget(cache_key, str(limit))
+            if cached is not None:
+                return _emails_from_json(cached)
+        
+        try:
+            emails = list(self.iter_received_emails(user_id, limit, include_content))
+            if cacheable:
+                self._cache_hset(cache_key, str(limit), _emails_to_json(emails), self.email_list_cache_ttl)
+            logger.info(f"Retrieved {len(emails)} received emails for user {user_id}")
+            return emails
         except Exception as e:
             logger.error(f"Failed to get received emails for user {user_id}: {e}")
             return []
     
+    def iter_received_emails(self, user_id: str, limit: int = None, include_content: bool = True):
+        """Stream emails received by user, newest first, from a server-side cursor"""
+        content_columns = ("encrypted_content AS content, encrypted_content,"
+                           if include_content else "")
+        with self._conn() as conn:
+            with conn.cursor(name=f"received_{uuid.uuid4().hex}", row_factory=dict_row) as cur:
+                cur.itersize = _STREAM_ITERSIZE
+                # Rows come back already shaped as the email dicts callers expect;
+                # the duplicate names are kept for consistency with other views
+                cur.execute(f"""
+                    SELECT id, sender, subject, ipfs_hash,
+                           encryption_key_id AS key_id, encryption_key_id,
+                           {content_columns}
+                           NULL::text AS blockchain_hash,
+                           sent_at AS timestamp, sent_at
+                    FROM email_statistics 
+                    WHERE user_id = %s AND email_type = 'received'
+                    ORDER BY sent_at DESC
+                    LIMIT %s
+                """, (user_id, limit))
+                
+                yield from cur
+    
     def get_email_statistics(self, user_id: str) -> dict:
-        """Get email statistics for a user"""
+        """Get email statistics for a user (cached in Redis when configured)"""
+        cache_key = f"qumail:stats:{user_id}"
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
-            with psycopg2.connect(self.database_url) as conn:
+            with self._conn() as conn:
                 with conn.cursor() as cur:
                     cur.execute("""
                         SELECT 
@@ -684,59 +1176,97 @@ class NeonKeyManager:
                             COUNT(*) FILTER (WHERE email_type = 'received') as emails_received
                         FROM email_statistics 
                         WHERE user_id = %s
-                    """, (user_id,))
+                    """, (user_id,), prepare=True)
                     
                     row = cur.fetchone()
                     
-                    return {
+                    stats = {
                         'emails_sent': row[0] or 0,
                         'emails_received': row[1] or 0
                     }
+            
+            self._cache_set(cache_key, stats, self.email_stats_cache_ttl)
+            return stats
                     
         except Exception as e:
             logger.error(f"Failed to get email statistics: {e}")
             return {'emails_sent': 0, 'emails_received': 0}
     
     def get_sent_emails(self, user_id: str, limit: int = 20) -> list:
-        """Get sent emails for a user"""
+        """Get sent emails for a user (cached in Redis when configured)"""
+        # One hash per user holds every requested limit, so a write drops them all at once
+        cache_key = f"qumail:sent:{user_id}"
+        cached = self._cache_hget(cache_key, str(limit))
+        if cached is not None:
+            return _emails_from_json(cached)
+        
         try:
-            with psycopg2.connect(self.database_url) as conn:
-                with conn.cursor() as cur:
+            with self._conn() as conn:
+                with conn.cursor(row_factory=dict_row) as cur:
+                    # Rows come back already shaped as the email dicts callers expect;
+                    # the duplicate names are kept for consistency with other views
                     cur.execute("""
-                        SELECT id, recipient, subject, ipfs_hash, encryption_key_id, encrypted_content, sent_at
+                        SELECT id, recipient, subject, ipfs_hash,
+                               encryption_key_id AS key_id, encryption_key_id,
+                               encrypted_content AS content, encrypted_content,
+                               NULL::text AS blockchain_hash,
+                               sent_at AS timestamp, sent_at
                         FROM email_statistics 
                         WHERE user_id = %s AND email_type = 'sent'
                         ORDER BY sent_at DESC
                         LIMIT %s
-                    """, (user_id, limit))
-                    
-                    emails = []
-                    for row in cur.fetchall():
-                        email = {
-                            'id': row[0],
-                            'recipient': row[1],
-                            'subject': row[2],
-                            'ipfs_hash': row[3],
-                            'key_id': row[4],
-                            'encryption_key_id': row[4],  # Add this for consistency
-                            'content': row[5],
-                            'encrypted_content': row[5],  # Add this for consistency
-                            'blockchain_hash': None,  # Not stored separately 
-                            'timestamp': row[6],
-                            'sent_at': row[6]  # Add this for consistency
-                        }
-                        emails.append(email)
+                    """, (user_id, limit), prepare=True)
                     
-                    return emails
+                    emails = cur.fetchall()
+            
+            self._cache_hset(cache_key, str(limit), _emails_to_json(emails), self.email_list_cache_ttl)
+            return emails
                     
         except Exception as e:
             logger.error(f"Failed to get sent emails: {e}")
             return []
 
+    def get_email_by_id(self, email_id, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get a single sent or received email belonging to a user"""
+        try:
+            with self._conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT id, email_type, recipient, sender, subject, ipfs_hash, 
+                               encryption_key_id, encrypted_content, sent_at
+                        FROM email_statistics 
+                        WHERE id = %s AND user_id = %s
+                    """, (email_id, user_id))
+                    
+                    row = cur.fetchone()
+                    if not row:
+                        return None
+                    
+                    return {
+                        'id': row[0],
+                        'type': row[1],
+                        'recipient': row[2],
+                        # Sender is the owner for sent emails
+                        'sender': user_id if row[1] == 'sent' else row[3],
+                        'subject': row[4],
+                        'ipfs_hash': row[5],
+                        'key_id': row[6],
+                        'encryption_key_id': row[6],
+                        'content': row[7],
+                        'encrypted_content': row[7],
+                        'blockchain_hash': None,
+                        'timestamp': row[8],
+                        'sent_at': row[8]
+                    }
+                    
+        except Exception as e:
+            logger.error(f"Failed to get email {email_id} for user {user_id}: {e}")
+            return None
+
     def delete_email(self, email_id: str, user_id: str) -> bool:
         """Delete an email from the database"""
         try:
-            with psycopg2.connect(self.database_url) as conn:
+            with self._conn() as conn:
                 with conn.cursor() as cur:
                     # Delete the email, ensuring it belongs to the user
                     cur.execute("""
@@ -748,6 +1278,7 @@ class NeonKeyManager:
                     conn.commit()
                     
                     if deleted_count > 0:
+                        self._invalidate_email_caches(user_id)
                         logger.info(f"Successfully deleted email {email_id} for user {user_id}")
                         return True
                     else:
@@ -758,25 +1289,84 @@ class NeonKeyManager:
             logger.error(f"Failed to delete email {email_id}: {e}")
             return False
 
+    def delete_emails_bulk(self, email_ids: list, user_id: str) -> int:
+        """Delete several of a user's emails in one statement, returns number deleted"""
+        # Ids arrive from the browser as strings or ints; ignore anything non-numeric
+        ids = []
+        for email_id in email_ids:
+            try:
+                ids.append(int(email_id))
+            except (TypeError, ValueError):
+                logger.warning(f"Skipping invalid email ID {email_id!r}")
+        
+        if not ids:
+            return 0
+        
+        try:
+            with self._conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        DELETE FROM email_statistics 
+                        WHERE id = ANY(%s) AND user_id = %s
+                    """, (ids, user_id))
+                    
+                    deleted_count = cur.rowcount
+                    conn.commit()
+                    
+                    if deleted_count > 0:
+                        self._invalidate_email_caches(user_id)
+                    logger.info(f"Deleted {deleted_count} emails for user {user_id}")
+                    return deleted_count
+                    
+        except Exception as e:
+            logger.error(f"Failed to bulk delete emails for {user_id}: {e}")
+            return 0
+
     # Authentication Methods
     def _hash_password(self, password: str) -> str:
-        """Hash password with salt for secure storage"""
-        salt = secrets.token_hex(32)
-        password_hash = hashlib.sha256((password + salt).encode()).hexdigest()
-        return f"{salt}:{password_hash}"
+        """Hash password with Argon2id for secure storage"""
+        return _PASSWORD_HASHER.hash(password)
     
     def _verify_password(self, password: str, stored_hash: str) -> bool:
-        """Verify password against stored hash"""
+        """Verify password against an Argon2id hash or a legacy salt:sha256 hash"""
+        if not stored_hash:
+            return False
+        if stored_hash.startswith(_ARGON2_PREFIX):
+            try:
+                return _PASSWORD_HASHER.verify(stored_hash, password)
+            except (VerificationError, InvalidHashError):
+                return False
         try:
             salt, password_hash = stored_hash.split(':')
-            return hashlib.sha256((password + salt).encode()).hexdigest() == password_hash
-        except:
+            computed = hashlib.sha256((password + salt).encode()).hexdigest()
+            return hmac.compare_digest(computed, password_hash)
+        except ValueError:
             return False
     
+    def _password_needs_rehash(self, stored_hash: str) -> bool:
+        """Whether a verified hash is legacy SHA-256 or uses outdated Argon2 parameters"""
+        if not stored_hash.startswith(_ARGON2_PREFIX):
+            return True
+        try:
+            return _PASSWORD_HASHER.check_needs_rehash(stored_hash)
+        except InvalidHashError:
+            return True
+    
     def _generate_otp(self) -> str:
         """Generate 6-digit OTP"""
         return f"{secrets.randbelow(1000000):06d}"
     
+    def _discard_otp(self, email: str, otp: str):
+        """Remove a stored OTP that could not be delivered"""
+        try:
+            with self._conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM otp_verification WHERE email = %s AND otp_code = %s",
+                                (email, otp))
+                    conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to discard undelivered OTP for {email}: {e}")
+    
     def _send_otp_email(self, email: str, otp: str, purpose: str = "verification") -> bool:
         """Send OTP via email"""
         try:
@@ -810,13 +1400,15 @@ class NeonKeyManager:
             
             msg.attach(MIMEText(body, 'plain'))
             
-            server = smtplib.SMTP(smtp_server, smtp_port)
-            if self.config.SMTP_USE_TLS:
-                server.starttls()
-            server.login(sender_email, sender_password)
-            text = msg.as_string()
-            server.sendmail(sender_email, email, text)
-            server.quit()
+            # Reuse the OTP SMTP session, reconnecting once if it went stale
+            with self._smtp_lock:
+                try:
+                    self._get_smtp().send_message(msg, from_addr=sender_email, to_addrs=[email])
+                except (smtplib.SMTPException, OSError) as e:
+                    logger.warning(f"OTP SMTP send failed ({e}), retrying on a new connection")
+                    self._drop_smtp()
+                    self._get_smtp().send_message(msg, from_addr=sender_email, to_addrs=[email])
+                self._smtp_last_used = time.monotonic()
             
             logger.info(f"OTP sent successfully to {email}")
             return True
@@ -825,36 +1417,99 @@ class NeonKeyManager:
             logger.error(f"Failed to send OTP to {email}: {e}")
             return False
     
+    def _queue_otp_email(self, email: str, otp: str, purpose: str) -> bool:
+        """
+        Send an OTP email in the background so the request doesn't wait on SMTP
+        
+        The OTP row must already be stored; it is removed again if delivery fails.
+        
+        Returns:
+            False if OTP mail is not configured, True once the send is queued
+        """
+        if not self.config.SYSTEM_EMAIL or not self.config.SYSTEM_EMAIL_PASSWORD:
+            logger.error("SYSTEM_EMAIL and SYSTEM_EMAIL_PASSWORD must be configured in environment variables")
+            return False
+        
+        with self._otp_executor_lock:
+            if self._otp_executor is None or self._otp_executor_pid != os.getpid():
+                # One worker: every OTP shares the single persistent SMTP session anyway
+                self._otp_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="otp-mail")
+                self._otp_executor_pid = os.getpid()
+            self._otp_executor.submit(self._deliver_otp_email, email, otp, purpose)
+        return True
+    
+    def _deliver_otp_email(self, email: str, otp: str, purpose: str):
+        """Background task: send an OTP and drop it if it could not be delivered"""
+        if not self._send_otp_email(email, otp, purpose):
+            self._discard_otp(email, otp)
+    
+    def _connect_smtp(self) -> smtplib.SMTP:
+        """Open and authenticate a new SMTP connection for OTP mail"""
+        server = smtplib.SMTP(self.config.SMTP_SERVER, self.config.SMTP_PORT, timeout=30)
+        if self.config.SMTP_USE_TLS:
+            server.starttls()
+        server.login(self.config.SYSTEM_EMAIL, self.config.SYSTEM_EMAIL_PASSWORD)
+        return server
+    
+    def _get_smtp(self) -> smtplib.SMTP:
+        """Return the OTP SMTP connection, reconnecting if it is gone (caller holds _smtp_lock)"""
+        if self._smtp is not None:
+            # Skip the NOOP round trip for a session that just sent successfully
+            if time.monotonic() - self._smtp_last_used < _SMTP_NOOP_AFTER:
+                return self._smtp
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._drop_smtp()
+        
+        self._smtp = self._connect_smtp()
+        logger.info(f"Connected to SMTP server {self.config.SMTP_SERVER}:{self.config.SMTP_PORT}")
+        return self._smtp
+    
+    def _drop_smtp(self):
+        """Discard the OTP SMTP connection (caller holds _smtp_lock)"""
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+            self._smtp_last_used = 0.0
+    
     def create_user_account(self, email: str, password: str) -> dict:
         """Create new user account with OTP verification"""
         try:
-            # Check if user already exists
-            with psycopg2.connect(self.database_url) as conn:
-                with conn.cursor() as cur:
-                    cur.execute("SELECT id FROM user_accounts WHERE email = %s", (email,))
-                    if cur.fetchone():
-                        return {"success": False, "error": "User already exists"}
-            
-            # Generate OTP and send email
+            # Generate OTP
             otp = self._generate_otp()
             otp_expires = datetime.now() + timedelta(minutes=10)
+            password_hash = self._hash_password(password)
             
-            if not self._send_otp_email(email, otp, "account creation"):
-                return {"success": False, "error": "Failed to send verification email"}
-            
-            # Store pending account with OTP
-            with psycopg2.connect(self.database_url) as conn:
+            # Store the pending account, replacing any earlier OTP, unless the
+            # user already exists - one statement
+            with self._conn() as conn:
                 with conn.cursor() as cur:
-                    # Clear any existing OTP for this email
-                    cur.execute("DELETE FROM otp_verification WHERE email = %s", (email,))
-                    
-                    # Store new OTP
                     cur.execute("""
                         INSERT INTO otp_verification (email, otp_code, purpose, expires_at, password_hash)
-                        VALUES (%s, %s, %s, %s, %s)
-                    """, (email, otp, 'registration', otp_expires, self._hash_password(password)))
+                        SELECT %s, %s, %s, %s, %s
+                        WHERE NOT EXISTS (SELECT 1 FROM user_accounts WHERE email = %s)
+                        ON CONFLICT (email) DO UPDATE
+                        SET otp_code = EXCLUDED.otp_code, purpose = EXCLUDED.purpose,
+                            expires_at = EXCLUDED.expires_at, password_hash = EXCLUDED.password_hash,
+                            is_used = FALSE, created_at = CURRENT_TIMESTAMP
+                        RETURNING id
+                    """, (email, otp, 'registration', otp_expires, password_hash, email))
+                    
+                    if not cur.fetchone():
+                        return {"success": False, "error": "User already exists"}
                     
                     conn.commit()
+            
+            # Send in the background after committing; the request doesn't wait on SMTP
+            if not self._queue_otp_email(email, otp, "account creation"):
+                self._discard_otp(email, otp)
+                return {"success": False, "error": "Failed to send verification email"}
                     
             return {"success": True, "message": "Verification code sent to your email"}
             
@@ -865,14 +1520,14 @@ class NeonKeyManager:
     def verify_registration_otp(self, email: str, otp: str) -> dict:
         """Verify OTP and complete account creation"""
         try:
-            with psycopg2.connect(self.database_url) as conn:
+            with self._conn() as conn:
                 with conn.cursor() as cur:
                     # Check OTP
                     cur.execute("""
                         SELECT password_hash FROM otp_verification 
                         WHERE email = %s AND otp_code = %s AND purpose = 'registration' 
                         AND expires_at > %s
-                    """, (email, otp, datetime.now()))
+                    """, (email, otp, datetime.now()), prepare=True)
                     
                     result = cur.fetchone()
                     if not result:
@@ -901,13 +1556,13 @@ class NeonKeyManager:
     def authenticate_user(self, email: str, password: str) -> dict:
         """Authenticate user login"""
         try:
-            with psycopg2.connect(self.database_url) as conn:
+            with self._conn() as conn:
                 with conn.cursor() as cur:
                     cur.execute("""
                         SELECT id, password_hash, failed_login_attempts, account_locked_until 
                         FROM user_accounts 
                         WHERE email = %s AND is_verified = true
-                    """, (email,))
+                    """, (email,), prepare=True)
                     
                     result = cur.fetchone()
                     if not result:
@@ -921,12 +1576,17 @@ class NeonKeyManager:
                     
                     # Verify password
                     if self._verify_password(password, password_hash):
+                        # Upgrade legacy or outdated hashes while we have the plaintext
+                        if self._password_needs_rehash(password_hash):
+                            password_hash = self._hash_password(password)
+                        
                         # Reset failed attempts on successful login
                         cur.execute("""
                             UPDATE user_accounts 
-                            SET failed_login_attempts = 0, account_locked_until = NULL, last_login = %s
+                            SET failed_login_attempts = 0, account_locked_until = NULL, last_login = %s,
+                                password_hash = %s
                             WHERE id = %s
-                        """, (datetime.now(), user_id))
+                        """, (datetime.now(), password_hash, user_id))
                         conn.commit()
                         
                         logger.info(f"Successful login for user {email}")
@@ -955,33 +1615,33 @@ class NeonKeyManager:
     def initiate_password_reset(self, email: str) -> dict:
         """Initiate password reset with OTP"""
         try:
-            # Check if user exists
-            with psycopg2.connect(self.database_url) as conn:
-                with conn.cursor() as cur:
-                    cur.execute("SELECT id FROM user_accounts WHERE email = %s", (email,))
-                    if not cur.fetchone():
-                        return {"success": False, "error": "Email not found"}
-            
-            # Generate OTP and send email
+            # Generate OTP
             otp = self._generate_otp()
             otp_expires = datetime.now() + timedelta(minutes=10)
             
-            if not self._send_otp_email(email, otp, "password reset"):
-                return {"success": False, "error": "Failed to send reset email"}
-            
-            # Store OTP for password reset
-            with psycopg2.connect(self.database_url) as conn:
+            # Store the reset OTP, replacing any earlier one, if the user exists - one statement
+            with self._conn() as conn:
                 with conn.cursor() as cur:
-                    # Clear any existing OTP for this email
-                    cur.execute("DELETE FROM otp_verification WHERE email = %s", (email,))
-                    
-                    # Store new OTP
                     cur.execute("""
-                        INSERT INTO otp_verification (email, otp_code, purpose, expires_at)
-                        VALUES (%s, %s, %s, %s)
-                    """, (email, otp, 'password_reset', otp_expires))
+                        INSERT INTO otp_verification (email, otp_code, purpose, expires_at, password_hash)
+                        SELECT %s, %s, %s, %s, NULL
+                        WHERE EXISTS (SELECT 1 FROM user_accounts WHERE email = %s)
+                        ON CONFLICT (email) DO UPDATE
+                        SET otp_code = EXCLUDED.otp_code, purpose = EXCLUDED.purpose,
+                            expires_at = EXCLUDED.expires_at, password_hash = EXCLUDED.password_hash,
+                            is_used = FALSE, created_at = CURRENT_TIMESTAMP
+                        RETURNING id
+                    """, (email, otp, 'password_reset', otp_expires, email))
+                    
+                    if not cur.fetchone():
+                        return {"success": False, "error": "Email not found"}
                     
                     conn.commit()
+            
+            # Send in the background after committing; the request doesn't wait on SMTP
+            if not self._queue_otp_email(email, otp, "password reset"):
+                self._discard_otp(email, otp)
+                return {"success": False, "error": "Failed to send reset email"}
                     
             return {"success": True, "message": "Password reset code sent to your email"}
             
@@ -992,14 +1652,14 @@ class NeonKeyManager:
     def reset_password_with_otp(self, email: str, otp: str, new_password: str) -> dict:
         """Reset password using OTP"""
         try:
-            with psycopg2.connect(self.database_url) as conn:
+            with self._conn() as conn:
                 with conn.cursor() as cur:
                     # Verify OTP
                     cur.execute("""
                         SELECT id FROM otp_verification 
                         WHERE email = %s AND otp_code = %s AND purpose = 'password_reset' 
                         AND expires_at > %s
-                    """, (email, otp, datetime.now()))
+                    """, (email, otp, datetime.now()), prepare=True)
                     
                     if not cur.fetchone():
                         return {"success": False, "error": "Invalid or expired reset code"}
@@ -23,7 +23,7 @@ print(f"Correct encrypted content: {correct_encrypted_content}")
 print()
 
 # Get the key
-user_keys = km.get_user_keys(recipient, include_expired=True)
+user_keys = km.get_user_keys(recipient, include_expired=True, decrypt_keys=True)
 decryption_key = None
 
 for key in user_keys:
@@ -23,7 +23,7 @@ print(f"Encrypted content: {encrypted_content}")
 print()
 
 # Get the key for the recipient
-user_keys = km.get_user_keys(recipient, include_expired=True)
+user_keys = km.get_user_keys(recipient, include_expired=True, decrypt_keys=True)
 decryption_key = None
 
 print(f"Available keys for {recipient}: {len(user_keys)}")
@@ -25,7 +25,7 @@ def test_decryption_types():
     correct_encrypted_content = "qHAs16oSkpslsGWjO4Dnebb9vtL4p1IeLtI="
     
     # Get the key (this works)
-    user_keys = key_manager.get_user_keys(recipient_email, include_expired=True)
+    user_keys = key_manager.get_user_keys(recipient_email, include_expired=True, decrypt_keys=True)
     decryption_key = None
     
     for key in user_keys:
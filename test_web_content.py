@@ -90,7 +90,7 @@ if inbox_email:
     encrypted_content = inbox_email['encrypted_content']
     
     # Get the key
-    user_keys = key_manager.get_user_keys(user_id, include_expired=True)
+    user_keys = key_manager.get_user_keys(user_id, include_expired=True, decrypt_keys=True)
     decryption_key = None
     for key in user_keys:
         if key['key_id'] == key_id:
@@ -20,9 +20,12 @@ logger.info(f"Python path: {sys.path[:3]}")
 
 try:
     # Import the Flask app
-    from qumail_client.app import app
+    from qumail_client.app import app, prepare_app
     logger.info("Successfully imported Flask app")
     
+    # Initialize components once here; with preload_app the workers inherit them
+    prepare_app()
+    
     # Test app creation
     with app.app_context():
         logger.info("Flask app context works")